@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+run many headless simulations of a level to balance levels_data.
+
+each run uses a seed and a placements script, a list of
+[seconds, tower class name, x, y] with the towers that the player adds
+while the level runs. the scripts are read from a json file with a
+list of them, for example:
+
+    [[], [[5, "CommonTower", 4, 8], [12, "HardTower", 12, 8]]]
+
+the runs are spread over all the cores, and the result of each one is
+written as a json line as soon as it finishes.
+
+usage: python balance.py LEVEL [-n RUNS] [-p PLACEMENTS] [-o OUTPUT]
+"""
+
+import json
+import multiprocessing
+import sys
+import time
+from optparse import OptionParser
+
+import veronica_logic
+from logic import Level
+from levels_data import levels_data
+
+
+def place_tower(level, tower_class_name, grid_pos):
+    """
+    add a tower as the player would, if possible
+    """
+    tower_class = getattr(veronica_logic, tower_class_name)
+    grid = level.world.grid
+    if level.resources.can_be_done('add tower') and \
+            not grid.is_out_at(tower_class, grid_pos) and \
+            grid.can_fit_at(tower_class, grid_pos):
+        level.add_tower(tower_class, grid_pos)
+
+
+def run_level(run):
+    """
+    run a level headless until it is done, in the steps of its clock
+    like the game, and return its results.
+
+    run is a tuple of (level number, seed, script number, script), so
+    it can be sent to the pool.
+    """
+    level_number, seed, script_number, script = run
+    result = {'level': level_number, 'seed': seed,
+              'script': script_number}
+
+    start = time.time()
+    try:
+        level = Level(levels_data[level_number], seed=seed)
+        level.start()
+
+        # each tower is placed before the first step at its time:
+        placements = sorted(script, key=lambda placement: placement[0])
+        while level.user_success is None:
+            while placements and placements[0][0] <= level.clock.time:
+                seconds, tower_class_name, x, y = placements.pop(0)
+                place_tower(level, tower_class_name, (x, y))
+            level.step()
+
+        result.update({
+            'user_success': level.user_success,
+            'hq_energy': level.world.hq.energy,
+            'leaks': level.enemies_passed,
+            'kills': level.enemies_killed,
+            'resources': level.resources.resources,
+            'level_secs': level.clock.time,
+        })
+    except Exception, e:
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+    result['run_secs'] = time.time() - start
+    return result
+
+
+def summarize(results):
+    """
+    return the lines of a summary of the results, per script
+    """
+    per_script = {}
+    for result in results:
+        per_script.setdefault(result['script'], []).append(result)
+
+    lines = []
+    for script_number in sorted(per_script):
+        script_results = per_script[script_number]
+        done = [result for result in script_results
+                if 'error' not in result]
+        errors = len(script_results) - len(done)
+        if not done:
+            lines.append('script %d: %d runs, all failed' % (
+                script_number, errors))
+            continue
+
+        def mean(key):
+            return float(sum(result[key] for result in done)) / len(done)
+
+        wins = sum(1 for result in done if result['user_success'])
+        lines.append('script %d: %d runs, %d failed, win rate %.1f%%, '
+                     'hq energy %.1f, leaks %.1f, resources %.1f' % (
+                         script_number, len(script_results), errors,
+                         100.0 * wins / len(done), mean('hq_energy'),
+                         mean('leaks'), mean('resources')))
+    return lines
+
+
+def main():
+    parser = OptionParser(usage='%prog LEVEL [options]')
+    parser.add_option('-n', '--runs', type='int', default=100,
+                      help='runs per placements script (default 100)')
+    parser.add_option('-p', '--placements',
+                      help='json file with the placements scripts')
+    parser.add_option('-o', '--output', default='balance_results.jsonl',
+                      help='file to write the results (default '
+                           'balance_results.jsonl)')
+    parser.add_option('-j', '--processes', type='int', default=None,
+                      help='processes to use (default: all the cores)')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('the level number is needed')
+
+    level_number = int(args[0])
+    if not 0 <= level_number < len(levels_data):
+        parser.error('there are %d levels' % len(levels_data))
+
+    scripts = [[]]
+    if options.placements is not None:
+        with open(options.placements) as placements_file:
+            scripts = json.load(placements_file)
+
+    runs = [(level_number, seed, script_number, script)
+            for script_number, script in enumerate(scripts)
+            for seed in xrange(options.runs)]
+
+    pool = multiprocessing.Pool(options.processes)
+    results = []
+    with open(options.output, 'w') as output:
+        for result in pool.imap_unordered(run_level, runs):
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            results.append(result)
+            sys.stdout.write('\r%d/%d runs' % (len(results), len(runs)))
+            sys.stdout.flush()
+    pool.close()
+    pool.join()
+
+    print
+    for line in summarize(results):
+        print line
+
+
+if __name__ == '__main__':
+    main()
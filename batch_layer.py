@@ -0,0 +1,130 @@
+import pyglet
+from pyglet.gl import *
+from pyglet.sprite import SpriteGroup
+
+from cocos.layer import Layer
+from cocos.sprite import Sprite
+from cocos import euclid
+
+
+class BatchLayer(Layer):
+    """
+    a layer that draws its sprites, and the sprites of its children
+    (the parts of the world sprites), from a single pyglet batch,
+    instead of one draw call per sprite.
+
+    the sprites are still cocos nodes that run their actions, but they
+    aren't visited. in each frame, the layer puts the corners of each
+    sprite, transformed by its parent's and its own transformations,
+    in the sprite's vertex list in the batch. the transformations are
+    only multiplied again for the sprites that moved, turned or scaled
+    since the last frame, or whose parent did (cocos marks their
+    transform dirty then), and the colors are only written again when
+    they change. the children that aren't sprites are visited as
+    usual, over the batch.
+    """
+    def __init__(self):
+        super(BatchLayer, self).__init__()
+        self.batch = pyglet.graphics.Batch()
+
+        # z -> ordered group, (texture, z) -> sprite group:
+        self.z_groups = {}
+        self.groups = {}
+
+        # sprite -> (vertex list, the look written in it):
+        self.vertex_lists = {}
+        
+        # the transformation of the sprites that are children of the
+        # layer:
+        self.identity = euclid.Matrix3()
+
+    def get_group(self, texture, z):
+        group = self.groups.get((texture, z))
+        if group is None:
+            z_group = self.z_groups.get(z)
+            if z_group is None:
+                z_group = self.z_groups[z] = pyglet.graphics.OrderedGroup(z)
+            group = self.groups[(texture, z)] = SpriteGroup(
+                texture, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, z_group)
+        return group
+
+    def visit(self):
+        if not self.visible:
+            return
+        glPushMatrix()
+        self.transform()
+
+        # the sprites still in the layer in this frame:
+        updated = set()
+        # (parent, node) of the nodes that aren't sprites:
+        others = []
+        for z, child in self.children:
+            if isinstance(child, Sprite):
+                self.update_sprite(child, self.identity, False, z, True)
+                updated.add(child)
+                continue
+            # read before get_local_transform clears it:
+            parent_moved = child.is_transform_dirty
+            matrix = child.get_local_transform()
+            for child_z, part in child.children:
+                if isinstance(part, Sprite):
+                    self.update_sprite(part, matrix, parent_moved,
+                                       z + child_z, child.visible)
+                    updated.add(part)
+                elif child.visible and part.visible:
+                    others.append((child, part))
+
+        # the sprites removed since the last frame:
+        for sprite in self.vertex_lists.keys():
+            if sprite not in updated:
+                self.vertex_lists.pop(sprite)[0].delete()
+
+        self.batch.draw()
+
+        for parent, node in others:
+            glPushMatrix()
+            parent.transform()
+            node.visit()
+            glPopMatrix()
+        glPopMatrix()
+
+    def update_sprite(self, sprite, parent_matrix, parent_moved, z,
+                      parent_visible):
+        """
+        write the vertices and colors of the sprite in its vertex list,
+        if they changed since the last frame
+        """
+        image = sprite.image
+        visible = parent_visible and sprite.visible
+        look = (visible, sprite.color, sprite.opacity, image)
+        moved = parent_moved or sprite.is_transform_dirty
+
+        vertex_list, last_look = self.vertex_lists.get(sprite, (None, None))
+        if not moved and look == last_look:
+            return
+        if vertex_list is not None and image is not last_look[-1]:
+            vertex_list.delete()
+            vertex_list = None
+        if vertex_list is None:
+            group = self.get_group(image.get_texture(), z)
+            vertex_list = self.batch.add(4, GL_QUADS, group, 'v2f', 'c4B',
+                                         ('t3f', image.tex_coords))
+        self.vertex_lists[sprite] = (vertex_list, look)
+
+        if not visible:
+            vertex_list.vertices[:] = [0.0] * 8
+            return
+        if look != last_look:
+            r, g, b = sprite.color
+            vertex_list.colors[:] = [r, g, b, int(sprite.opacity)] * 4
+        m = parent_matrix * sprite.get_local_transform()
+        # the corners, with the anchor of the image at the origin:
+        x1 = -sprite.image_anchor_x
+        y1 = -sprite.image_anchor_y
+        x2 = x1 + image.width
+        y2 = y1 + image.height
+        vertices = []
+        for x, y in ((x1, y1), (x2, y1), (x2, y2), (x1, y2)):
+            vertices.append(m.a * x + m.b * y + m.c)
+            vertices.append(m.e * x + m.f * y + m.g)
+        vertex_list.vertices[:] = vertices
@@ -0,0 +1,663 @@
+#!/usr/bin/env python
+"""
+benchmarks of the game logic, they don't need the GUI.
+
+each benchmark gives the seconds of one call of what it measures (a
+move, an update, a whole level...), the best of some rounds. the
+results can be saved to a json file, and compared with the results
+saved before to find the benchmarks that got slower.
+
+usage: python bench.py [-k NAME] [-o RESULTS] [-c BASELINE]
+
+for example, to save a baseline and check a change against it:
+
+  python bench.py -o baseline.json
+  python bench.py -c baseline.json
+
+python bench.py -m checks instead that the sprites listen weakly to
+the enemies, and that the memory doesn't grow while enemies are
+spawned and killed.
+"""
+
+import gc
+import json
+import platform
+import random
+import resource
+import sys
+import time
+import weakref
+from optparse import OptionParser
+
+from logic import Grid, ArrayGrid, World, Enemy, Rock, Tower, Hq, Level
+from flow_field import FlowField, ArrayFlowField
+from targeting import find_targets
+from levels_data import levels_data
+from notifier import Notifier, notify
+
+
+def timed(func, repeat):
+    """
+    call func repeat times and return the seconds taken by each call
+    """
+    start = time.time()
+    for i in xrange(repeat):
+        func()
+    return (time.time() - start) / repeat
+
+
+def bench_grid_move(objects_number, grid_size=(256, 256), repeat=20000):
+    """
+    time Grid.move with objects_number objects in the grid
+    """
+    random.seed(0)
+    grid = Grid(grid_size)
+
+    # the enemy being timed goes back and forth between these cells:
+    positions = [(0, 0), (0, 1)]
+
+    for i in xrange(objects_number):
+        pos = (random.randint(0, grid_size[0] - 1),
+               random.randint(0, grid_size[1] - 1))
+        world_obj = Rock() if i % 2 else Enemy()
+        if pos not in positions and \
+                grid.can_fit_at(world_obj.__class__, pos):
+            grid.add(world_obj, pos)
+
+    enemy = Enemy()
+    grid.add(enemy, positions[0])
+    state = {'i': 0}
+
+    def move():
+        state['i'] = 1 - state['i']
+        grid.move(enemy, positions[state['i']])
+
+    return timed(move, repeat)
+
+
+def fill_grid(grid, objects_number, grid_size):
+    """
+    add objects_number rocks and enemies to the grid, in random cells
+    """
+    random.seed(0)
+    for i in xrange(objects_number):
+        pos = (random.randint(0, grid_size[0] - 1),
+               random.randint(0, grid_size[1] - 1))
+        world_obj = Rock() if i % 2 else Enemy()
+        if grid.can_fit_at(world_obj.__class__, pos):
+            grid.add(world_obj, pos)
+
+
+def bench_grid_add_remove(objects_number, grid_size=(256, 256),
+                          repeat=20000):
+    """
+    time adding a tower to the grid and removing it, with
+    objects_number objects in the grid
+    """
+    grid = Grid(grid_size)
+    fill_grid(grid, objects_number, grid_size)
+    for x in xrange(2):
+        for y in xrange(2):
+            for world_obj in list(grid.grid.get((x, y), ())):
+                grid.remove(world_obj)
+
+    tower = Tower()
+
+    def add_remove():
+        grid.add(tower, (0, 0))
+        grid.remove(tower)
+
+    return timed(add_remove, repeat)
+
+
+def bench_grid_can_fit_at(objects_number, grid_size=(256, 256),
+                          repeat=20000):
+    """
+    time asking if a tower fits in random cells of the grid, with
+    objects_number objects in the grid
+    """
+    grid = Grid(grid_size)
+    fill_grid(grid, objects_number, grid_size)
+    positions = [(random.randint(0, grid_size[0] - 2),
+                  random.randint(0, grid_size[1] - 2))
+                 for i in xrange(100)]
+    state = {'i': 0}
+
+    def can_fit_at():
+        state['i'] = (state['i'] + 1) % len(positions)
+        grid.can_fit_at(Tower, positions[state['i']])
+
+    return timed(can_fit_at, repeat)
+
+
+def bench_placement_mask(grid_size, rocks_number=None, repeat=5):
+    """
+    time ArrayGrid.get_placement_mask of the towers, with rocks in a
+    tenth of the cells (by default)
+    """
+    if rocks_number is None:
+        rocks_number = grid_size[0] * grid_size[1] / 10
+    grid = ArrayGrid(grid_size)
+    random.seed(0)
+    for i in xrange(rocks_number):
+        pos = (random.randint(0, grid_size[0] - 1),
+               random.randint(0, grid_size[1] - 1))
+        if grid.can_fit_at(Rock, pos):
+            grid.add(Rock(), pos)
+    return timed(lambda: grid.get_placement_mask(Tower), repeat)
+
+
+def bench_tower_paths(grid_size, towers_number=20, grid_class=Grid,
+                      flow_field_class=FlowField, seed_from_arrays=False):
+    """
+    time World.calculate_paths when towers are placed and then
+    removed, doing a full calculation and repairing the paths.
+
+    seed_from_arrays: if True, the full calculation of the dict flow
+    field is copied from an ArrayFlowField, for the large grids where
+    calculating it takes too long to set up the repairs.
+
+    return the seconds of a full calculation and the mean seconds of
+    a repair.
+    """
+    random.seed(0)
+    world = World(grid_size, grid_class=grid_class,
+                  flow_field_class=flow_field_class)
+    world.add(Hq(), (grid_size[0] / 2, grid_size[1] - 1))
+
+    start = time.time()
+    if seed_from_arrays:
+        seed_flow_field(world.flow_field, world.hq.grid_pos)
+    else:
+        world.calculate_paths()
+    full_secs = time.time() - start
+
+    towers = []
+    repair_secs = 0
+    while len(towers) < towers_number:
+        pos = (random.randint(0, grid_size[0] - 2),
+               random.randint(0, grid_size[1] - 3))
+        if world.grid.can_fit_at(Tower, pos):
+            tower = Tower()
+            world.add(tower, pos)
+            towers.append(tower)
+            start = time.time()
+            world.calculate_paths(world.grid.get_cells(tower))
+            repair_secs += time.time() - start
+
+    for tower in towers:
+        changed_cells = world.grid.get_cells(tower)
+        world.remove(tower)
+        start = time.time()
+        world.calculate_paths(changed_cells)
+        repair_secs += time.time() - start
+
+    return full_secs, repair_secs / (2 * towers_number)
+
+
+def seed_flow_field(flow_field, target):
+    """
+    fill a dict flow field with the calculation of an ArrayFlowField
+    """
+    array_flow_field = ArrayFlowField(flow_field.grid)
+    array_flow_field.calculate(target)
+    width = flow_field.grid.size[0]
+    flow_field.target = target
+    flow_field.paths = array_flow_field.paths
+    flow_field.distances = dict(
+        ((index % width, index // width), distance)
+        for index, distance in enumerate(array_flow_field.distances)
+        if distance != -1)
+
+
+def bench_array_flow_field(grid_size, rocks_number=None):
+    """
+    time a full calculation of an ArrayFlowField, on an ArrayGrid with
+    some random rocks.
+    """
+    random.seed(0)
+    grid = ArrayGrid(grid_size)
+    target = (grid_size[0] / 2, grid_size[1] / 2)
+    if rocks_number is None:
+        rocks_number = grid_size[0] * grid_size[1] / 10
+    for i in xrange(rocks_number):
+        pos = (random.randint(0, grid_size[0] - 1),
+               random.randint(0, grid_size[1] - 1))
+        if pos != target and grid.can_fit_at(Rock, pos):
+            grid.add(Rock(), pos)
+
+    flow_field = ArrayFlowField(grid)
+    return timed(lambda: flow_field.calculate(target), 1)
+
+
+def bench_targeting(towers_number, enemies_number, grid_size=(256, 256),
+                    repeat=3):
+    """
+    time finding the targets of all the towers, each tower on its own
+    and all of them in batch.
+
+    return the seconds of each way.
+    """
+    random.seed(0)
+    world = World(grid_size)
+    while len(world.towers) < towers_number:
+        pos = (random.randint(0, grid_size[0] - 2),
+               random.randint(0, grid_size[1] - 2))
+        if world.grid.can_fit_at(Tower, pos):
+            world.add(Tower(), pos)
+    while len(world.enemies) < enemies_number:
+        pos = (random.randint(0, grid_size[0] - 1),
+               random.randint(0, grid_size[1] - 1))
+        if world.grid.can_fit_at(Enemy, pos):
+            world.add(Enemy(), pos)
+
+    def per_tower():
+        for tower in world.towers:
+            tower.find_target()
+
+    def batch():
+        find_targets(world.towers, world.enemy_pool, world.flow_field)
+
+    return timed(per_tower, repeat), timed(batch, repeat)
+
+
+def bench_level_run(level_data, seed=0):
+    """
+    time running a whole level headless, in the steps of its clock.
+    """
+    level = Level(level_data, seed=seed)
+    level.start()
+    return timed(level.run, 1)
+
+
+def bench_many_enemies(enemies_number, grid_size=(512, 512), ticks=60):
+    """
+    time the updates of a headless world full of moving enemies, and
+    no towers.
+
+    return the seconds per update.
+    """
+    random.seed(0)
+    world = World(grid_size)
+    world.simulates_motion = True
+    world.add(Hq(), (grid_size[0] / 2, grid_size[1] - 1))
+    world.calculate_paths()
+    for i in xrange(enemies_number):
+        enemy = Enemy()
+        world.add(enemy, (random.randint(0, grid_size[0] - 1),
+                          random.randint(0, grid_size[1] / 2)))
+        enemy.start_move()
+
+    return timed(lambda: world.update(world.clock.step), ticks)
+
+
+def bench_scenario(towers_number, enemies_number, grid_size,
+                   max_ticks=600):
+    """
+    time the updates of a headless world with towers_number towers,
+    until the enemies_number enemies that start in the top half are
+    killed or get to the hq.
+
+    return the seconds per update.
+    """
+    random.seed(0)
+    world = World(grid_size)
+    world.simulates_motion = True
+    world.add(Hq(), (grid_size[0] / 2, grid_size[1] - 1))
+
+    # in a lattice with room between them, so they never close the
+    # way to the hq:
+    spots = [(x, y) for x in xrange(1, grid_size[0] - 2, 4)
+             for y in xrange(grid_size[1] / 2, grid_size[1] - 3, 4)]
+    random.shuffle(spots)
+    for pos in spots[:towers_number]:
+        world.add(Tower(), pos)
+    world.calculate_paths()
+
+    while len(world.enemies) < enemies_number:
+        pos = (random.randint(0, grid_size[0] - 1),
+               random.randint(0, grid_size[1] / 2 - 1))
+        enemy = Enemy()
+        world.add(enemy, pos)
+        enemy.start_move()
+
+    state = {'ticks': 0}
+
+    def run():
+        while world.enemies and state['ticks'] < max_ticks:
+            world.update(world.clock.step)
+            world.clock.tick()
+            state['ticks'] += 1
+
+    secs = timed(run, 1)
+    return secs / max(state['ticks'], 1)
+
+
+class BenchNotifier(Notifier):
+    @notify
+    def update(self):
+        pass
+
+
+class BenchListener(object):
+    def on_update(self, notifier):
+        pass
+
+
+class BenchDeafListener(object):
+    pass
+
+
+def getattr_notify(notifier, event_name):
+    """
+    the way Notifier.notify used to look for the handlers
+    """
+    for listener in notifier.listeners:
+        callback = getattr(listener, 'on_' + event_name, None)
+        if callback is not None:
+            callback(notifier)
+
+
+def bench_notify(listeners_number, repeat=100000):
+    """
+    time notifying an event to listeners_number listeners, half of
+    them handling it, with the cached handlers and looking them up in
+    each listener.
+
+    return the seconds per call of each way.
+    """
+    notifier = BenchNotifier()
+    for i in xrange(listeners_number):
+        if i % 2:
+            notifier.add_listener(BenchDeafListener())
+        else:
+            notifier.add_listener(BenchListener())
+
+    def cached_update():
+        notifier.notify('update')
+
+    def getattr_update():
+        getattr_notify(notifier, 'update')
+
+    return timed(cached_update, repeat), timed(getattr_update, repeat)
+
+
+class BenchSprite(object):
+    """
+    listens to an enemy like its sprite (a WorldSprite), weakly, and
+    refers to the enemy while it moves.
+    """
+    def __init__(self, enemy):
+        self.enemy = enemy
+        enemy.add_listener(self, weak=True)
+        enemy.sprite = self
+
+    def on_get_hurt(self, enemy, damage):
+        pass
+
+    def on_enemy_die(self, enemy):
+        pass
+
+
+class BenchLevel(object):
+    def __init__(self):
+        self.enemies_killed = 0
+
+    def on_enemy_die(self, enemy):
+        self.enemies_killed += 1
+
+
+def get_max_rss():
+    """
+    the most memory used by the process so far, in KB (in bytes on
+    mac os)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def check_memory(cycles=100000, checkpoints=10):
+    """
+    spawn and kill cycles enemies, one per update, each one with a
+    sprite and a level listening to it, and return the max rss of the
+    process after each of checkpoints parts of the cycles.
+
+    the garbage collector is disabled meanwhile, so the enemies are
+    freed only if nothing keeps them alive after they die.
+    """
+    world = World((32, 32))
+    world.add(Hq(), (16, 31))
+    world.calculate_paths()
+    level = BenchLevel()
+
+    max_rss = []
+    gc.disable()
+    try:
+        for i in xrange(checkpoints):
+            for j in xrange(cycles / checkpoints):
+                enemy = Enemy()
+                BenchSprite(enemy)
+                enemy.add_listener(level)
+                world.add(enemy, (j % 32, 0))
+                enemy.start_move()
+                world.update(world.clock.step)
+                world.hurt(enemy, enemy.lives)
+            del enemy
+            world.update(world.clock.step)
+            max_rss.append(get_max_rss())
+    finally:
+        gc.enable()
+    assert level.enemies_killed == cycles / checkpoints * checkpoints
+    return max_rss
+
+
+def check_weak_listeners(enemies_number=1000):
+    """
+    drop the sprites of enemies that stay in the world, like the GUI
+    when the level scene ends, and return how many sprites are still
+    alive. only the weak references of the enemies point to them, so
+    none should be.
+    """
+    world = World((32, 32))
+    world.add(Hq(), (16, 31))
+    world.calculate_paths()
+
+    sprite_refs = []
+    gc.disable()
+    try:
+        for i in xrange(enemies_number):
+            enemy = Enemy()
+            sprite_refs.append(weakref.ref(BenchSprite(enemy)))
+            world.add(enemy, (i % 32, 0))
+            enemy.start_move()
+        for enemy in world.enemies:
+            enemy.sprite = None
+        del enemy
+        alive = sum(1 for sprite_ref in sprite_refs
+                    if sprite_ref() is not None)
+    finally:
+        gc.enable()
+    return alive
+
+
+def get_benchmarks():
+    """
+    the (name, function) of each benchmark, the function returns the
+    seconds of one call of what it measures.
+    """
+    benchmarks = []
+
+    def add(name, func):
+        benchmarks.append((name, func))
+
+    for listeners_number in (0, 1, 10, 100):
+        add('Notifier.notify/listeners=%d' % listeners_number,
+            lambda listeners_number=listeners_number:
+                bench_notify(listeners_number)[0])
+
+    for objects_number in (10, 1000, 10000):
+        add('Grid.add+remove/objects=%d' % objects_number,
+            lambda objects_number=objects_number:
+                bench_grid_add_remove(objects_number))
+        add('Grid.move/objects=%d' % objects_number,
+            lambda objects_number=objects_number:
+                bench_grid_move(objects_number))
+        add('Grid.can_fit_at/objects=%d' % objects_number,
+            lambda objects_number=objects_number:
+                bench_grid_can_fit_at(objects_number))
+
+    for side in (256, 1024):
+        add('ArrayGrid.get_placement_mask/%dx%d' % (side, side),
+            lambda side=side: bench_placement_mask((side, side)))
+
+    for side in (64, 256):
+        add('World.calculate_paths/full/%dx%d' % (side, side),
+            lambda side=side: bench_tower_paths((side, side))[0])
+        add('World.calculate_paths/repair/%dx%d' % (side, side),
+            lambda side=side: bench_tower_paths((side, side))[1])
+    add('World.calculate_paths/repair/1024x1024',
+        lambda: bench_tower_paths((1024, 1024), seed_from_arrays=True)[1])
+
+    for side in (256, 1024):
+        add('ArrayFlowField.calculate/%dx%d' % (side, side),
+            lambda side=side: bench_array_flow_field((side, side)))
+    add('ArrayFlowField.repair/1024x1024',
+        lambda: bench_tower_paths((1024, 1024), grid_class=ArrayGrid,
+                                  flow_field_class=ArrayFlowField)[1])
+
+    for towers_number, enemies_number in ((10, 100), (100, 1000),
+                                          (300, 5000)):
+        name = 'targeting/towers=%d/enemies=%d' % (towers_number,
+                                                   enemies_number)
+        add(name + '/per tower',
+            lambda towers_number=towers_number,
+                   enemies_number=enemies_number:
+                bench_targeting(towers_number, enemies_number,
+                                grid_size=(64, 64))[0])
+        add(name + '/batch',
+            lambda towers_number=towers_number,
+                   enemies_number=enemies_number:
+                bench_targeting(towers_number, enemies_number,
+                                grid_size=(64, 64))[1])
+
+    for enemies_number in (1000, 10000, 50000):
+        add('World.update/enemies=%d' % enemies_number,
+            lambda enemies_number=enemies_number:
+                bench_many_enemies(enemies_number))
+
+    # the macro scenarios, seconds per update:
+    for towers_number, enemies_number, side in ((10, 100, 32),
+                                                (50, 1000, 64),
+                                                (200, 5000, 128)):
+        add('scenario/towers=%d/enemies=%d/%dx%d' % (
+                towers_number, enemies_number, side, side),
+            lambda towers_number=towers_number,
+                   enemies_number=enemies_number, side=side:
+                bench_scenario(towers_number, enemies_number,
+                               (side, side)))
+
+    for number, level_data in enumerate(levels_data):
+        add('level %d' % number,
+            lambda level_data=level_data: bench_level_run(level_data))
+
+    return benchmarks
+
+
+def run_benchmarks(benchmarks, rounds):
+    """
+    run each benchmark rounds times, returns a dict of name -> best
+    seconds.
+    """
+    results = {}
+    for name, func in benchmarks:
+        results[name] = min(func() for i in xrange(rounds))
+        print '%-50s %12.2f usec' % (name, results[name] * 1e6)
+        sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    return the lines of the comparison of results with the baseline
+    ones, and the names of the benchmarks slower than the baseline by
+    more than threshold (0.2 is 20% slower).
+    """
+    lines = []
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name] / baseline[name] if baseline[name] else 1.0
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            mark = 'SLOWER'
+        elif ratio < 1 / (1 + threshold):
+            mark = 'faster'
+        else:
+            mark = ''
+        lines.append('%-50s %6.2fx %s' % (name, ratio, mark))
+    return lines, regressions
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-k', '--keyword', default='',
+                      help='run only the benchmarks with this in their '
+                           'name')
+    parser.add_option('-r', '--rounds', type='int', default=3,
+                      help='rounds of each benchmark, the best one '
+                           'counts (default 3)')
+    parser.add_option('-o', '--output',
+                      help='json file to save the results')
+    parser.add_option('-c', '--compare', metavar='BASELINE',
+                      help='json file with results to compare with')
+    parser.add_option('-t', '--threshold', type='float', default=0.2,
+                      help='how much slower than the baseline is a '
+                           'regression (default 0.2, 20%)')
+    parser.add_option('-m', '--memory', action='store_true',
+                      help='check the memory of 100k spawn/die cycles, '
+                           'instead of running the benchmarks')
+    options, args = parser.parse_args()
+
+    if options.memory:
+        alive = check_weak_listeners()
+        print '%d sprites kept alive by the enemies' % alive
+        if alive:
+            sys.exit(1)
+        max_rss = check_memory()
+        for checkpoint, rss in enumerate(max_rss):
+            print '%6d cycles %10d KB' % ((checkpoint + 1) * 10000, rss)
+        # the first part warms up the pools and the caches:
+        growth = max_rss[-1] - max_rss[0]
+        print 'grew %d KB after the first 10000 cycles' % growth
+        if growth > 1024:
+            sys.exit(1)
+        return
+
+    benchmarks = [(name, func) for name, func in get_benchmarks()
+                  if options.keyword in name]
+    results = run_benchmarks(benchmarks, options.rounds)
+
+    if options.output is not None:
+        with open(options.output, 'w') as output:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'results': results},
+                      output, indent=1, sort_keys=True)
+
+    if options.compare is not None:
+        with open(options.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        lines, regressions = compare(results, baseline,
+                                     options.threshold)
+        print
+        print 'compared with %s:' % options.compare
+        for line in lines:
+            print line
+        if regressions:
+            print '%d benchmarks got slower' % len(regressions)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
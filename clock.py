@@ -0,0 +1,80 @@
+"""
+
+the time of the simulation
+
+"""
+
+
+class Clock(object):
+    """
+    the simulated time, that every time dependent rule reads.
+
+    the simulation advances in fixed steps, so it gives the same
+    results at any speed, or when it runs as fast as possible.
+
+    >>> clock = Clock(step=0.5)
+    >>> clock.set_speed(4)
+    >>> print clock.advance(1.0)
+    8
+    >>> clock.pause()
+    >>> print clock.advance(1.0)
+    0
+    >>> for i in range(3):
+    ...     clock.tick()
+    >>> print clock.time
+    1.5
+    """
+    # the speeds to choose from, in simulated seconds per real second:
+    speeds = (1, 2, 4, 16)
+
+    def __init__(self, step):
+        """
+        step: the simulated seconds that pass in each step
+        """
+        self.step = step
+        self.steps = 0
+
+        self.speed = 1
+        self.is_paused = False
+
+        # simulated seconds not yet run as steps:
+        self.pending = 0.0
+
+    def get_time(self):
+        """
+        the simulated seconds since the start
+        """
+        return self.steps * self.step
+    time = property(get_time)
+
+    def set_speed(self, speed):
+        assert speed in self.speeds
+        self.speed = speed
+
+    def pause(self):
+        self.is_paused = True
+
+    def resume(self):
+        self.is_paused = False
+
+    def advance(self, real_dt):
+        """
+        return the number of steps to run for real_dt real seconds
+        """
+        if self.is_paused:
+            return 0
+        self.pending += real_dt * self.speed
+        steps = int(self.pending / self.step)
+        self.pending -= steps * self.step
+        return steps
+
+    def tick(self):
+        """
+        called after each step is run
+        """
+        self.steps += 1
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,212 @@
+"""
+
+the state of the enemies of a world, kept in parallel arrays
+
+"""
+
+import heapq
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class EnemyPool(object):
+    """
+    the lives, the movement and the class of the enemies in a world,
+    each one in an array indexed by the enemy's slot. an enemy in the
+    world is only a handle to its slot, so the enemies take little
+    memory and the whole pool can be moved or hurt at once, with numpy
+    if it is installed.
+
+    the slots of the removed enemies are reused, the lowest first.
+
+    >>> class Enemy(object):
+    ...     speed = 2.0
+    ...     lives = 3
+    ...     move_progress = 0.0
+    ...     next_direction = (0, 1)
+    ...     grid_pos = (4, 4)
+    >>> pool = EnemyPool()
+    >>> enemy = Enemy()
+    >>> pool.add(enemy)
+    >>> print enemy.index, pool.lives[enemy.index]
+    0 3
+    >>> print pool.advance(0.25) == []
+    True
+    >>> print pool.advance(0.25) == [enemy]
+    True
+    >>> pool.add_damage(enemy.index, 2)
+    >>> print pool.apply_damage() == [(enemy, 2)], pool.lives[enemy.index]
+    True 1
+    >>> pool.remove(enemy)
+    >>> print enemy.index, enemy.lives, enemy.move_progress
+    None 1 1.0
+    """
+    def __init__(self, capacity=64):
+        # slot -> enemy, None for the free slots:
+        self.handles = []
+
+        # the slots after the last used one are never free, only the
+        # slots before it are used in the operations of the pool:
+        self.free = []
+        self.size = 0
+        self.capacity = 0
+
+        # enemy class -> its id in class_ids, and the other way:
+        self.class_id_per_class = {}
+        self.classes = []
+
+        self.lives = array('i')
+        self.damage = array('i')
+        self.progress = array('d')
+        self.speed = array('d')
+        self.class_ids = array('H')
+        self.cell_x = array('i')
+        self.cell_y = array('i')
+        self.direction_x = array('b')
+        self.direction_y = array('b')
+        # 1 if the enemy is moving to a next cell:
+        self.moving = bytearray()
+
+        self.grow(capacity)
+
+    def __len__(self):
+        return self.size - len(self.free)
+
+    def grow(self, capacity):
+        """
+        make room for capacity enemies
+        """
+        extra = capacity - self.capacity
+        self.handles.extend([None] * extra)
+        for values in (self.lives, self.damage, self.cell_x, self.cell_y):
+            values.extend(array('i', [0]) * extra)
+        for values in (self.progress, self.speed):
+            values.extend(array('d', [0.0]) * extra)
+        self.class_ids.extend(array('H', [0]) * extra)
+        self.direction_x.extend(array('b', [0]) * extra)
+        self.direction_y.extend(array('b', [0]) * extra)
+        self.moving.extend(bytearray(extra))
+        self.capacity = capacity
+
+    def add(self, enemy):
+        """
+        give a slot to the enemy, with the values that it has
+        """
+        if self.free:
+            index = heapq.heappop(self.free)
+        else:
+            if self.size == self.capacity:
+                self.grow(self.capacity * 2)
+            index = self.size
+            self.size += 1
+
+        enemy_class = enemy.__class__
+        class_id = self.class_id_per_class.get(enemy_class)
+        if class_id is None:
+            class_id = self.class_id_per_class[enemy_class] = \
+                len(self.classes)
+            self.classes.append(enemy_class)
+
+        self.handles[index] = enemy
+        self.lives[index] = enemy.lives
+        self.damage[index] = 0
+        self.progress[index] = enemy.move_progress
+        self.speed[index] = enemy.speed
+        self.class_ids[index] = class_id
+        self.set_cell(index, enemy.grid_pos)
+        self.set_direction(index, enemy.next_direction)
+
+        enemy.pool = self
+        enemy.index = index
+
+    def remove(self, enemy):
+        """
+        free the slot of the enemy, that keeps its last values
+        """
+        index = enemy.index
+        enemy.pool = None
+        enemy.index = None
+        enemy.lives = self.lives[index]
+        enemy.move_progress = self.progress[index]
+
+        self.handles[index] = None
+        self.moving[index] = 0
+        self.damage[index] = 0
+        heapq.heappush(self.free, index)
+
+    def set_cell(self, index, grid_pos):
+        self.cell_x[index], self.cell_y[index] = grid_pos
+
+    def set_direction(self, index, direction):
+        """
+        the direction to the next cell, or None if it doesn't move
+        """
+        if direction is None:
+            self.moving[index] = 0
+        else:
+            self.moving[index] = 1
+            self.direction_x[index], self.direction_y[index] = direction
+
+    def add_damage(self, index, damage):
+        self.damage[index] += damage
+
+    def advance(self, dt):
+        """
+        add the way done in dt seconds by the moving enemies, returns
+        the enemies that got to their next cell.
+        """
+        if numpy is not None:
+            size = self.size
+            progress = numpy.frombuffer(self.progress)[:size]
+            speed = numpy.frombuffer(self.speed)[:size]
+            moving = numpy.frombuffer(self.moving, dtype=numpy.uint8)[:size]
+            progress += dt * speed * moving
+            arrived = numpy.flatnonzero((progress >= 1) & (moving == 1))
+            handles = self.handles
+            return [handles[index] for index in arrived]
+
+        arrived = []
+        progress, speed, moving = self.progress, self.speed, self.moving
+        for index in xrange(self.size):
+            if moving[index]:
+                progress[index] += dt * speed[index]
+                if progress[index] >= 1:
+                    arrived.append(self.handles[index])
+        return arrived
+
+    def apply_damage(self):
+        """
+        take the damage added up from the lives, returns the (enemy,
+        damage) of the enemies hurt.
+        """
+        if numpy is not None:
+            size = self.size
+            lives = numpy.frombuffer(self.lives, dtype=numpy.int32)[:size]
+            damage = numpy.frombuffer(self.damage, dtype=numpy.int32)[:size]
+            hurt = numpy.flatnonzero(damage)
+            if not hurt.size:
+                return []
+            damages = damage[hurt]
+            lives[hurt] -= damages
+            damage[hurt] = 0
+            handles = self.handles
+            return [(handles[index], int(index_damage))
+                    for index, index_damage in zip(hurt, damages)]
+
+        hurt = []
+        lives, damage = self.lives, self.damage
+        for index in xrange(self.size):
+            if damage[index]:
+                lives[index] -= damage[index]
+                hurt.append((self.handles[index], damage[index]))
+                damage[index] = 0
+        return hurt
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
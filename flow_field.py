@@ -0,0 +1,573 @@
+"""
+
+the paths that the enemies follow to reach the hq
+
+"""
+
+import heapq
+from array import array
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class FlowField(object):
+    """
+    the direction to move from each grid cell to get closer to a
+    target cell, avoiding the solid cells.
+
+    after a full calculation, the field can be repaired when some
+    cells become solid or free, touching only the cells whose distance
+    to the target changes.
+
+    a direction goes to the neighbour nearest to the target, the first
+    one of the grid's possible_dirs if there is a tie. solid cells
+    next to a reachable cell also get a direction, so an enemy that
+    stands where a tower was added can still move away.
+
+    >>> from logic import Grid, Rock
+    >>> grid = Grid((6, 5))
+    >>> field = FlowField(grid)
+    >>> field.calculate((0, 2))
+    >>> def toggle(cells):
+    ...     for cell in cells:
+    ...         if grid.is_solid_at(cell):
+    ...             grid.remove(grid.get_at(cell))
+    ...         else:
+    ...             grid.add(Rock(), cell)
+    ...     field.repair(cells)
+    ...     fresh = FlowField(grid)
+    ...     fresh.calculate(field.target)
+    ...     return (field.distances == fresh.distances and
+    ...             field.paths == fresh.paths)
+
+    a wall with a gap, and then the gap closed, that cuts off the
+    cells behind it:
+
+    >>> toggle([(3, y) for y in range(4)])
+    True
+    >>> field.get_distance((5, 0))
+    11
+    >>> toggle([(3, 4)])
+    True
+    >>> field.get_distance((5, 0)) is None
+    True
+
+    opening the wall again, and changing random cells:
+
+    >>> toggle([(3, 1)])
+    True
+    >>> field.get_distance((5, 0))
+    7
+    >>> import random
+    >>> rand = random.Random(0)
+    >>> all(toggle([(rand.randrange(6), rand.randrange(5))
+    ...             for i in range(rand.randint(1, 3))])
+    ...     for j in range(200))
+    True
+    """
+    def __init__(self, grid):
+        self.grid = grid
+
+        # grid cell -> steps to the target, for the reachable cells
+        # that aren't solid:
+        self.distances = {}
+
+        # grid cell -> direction to move:
+        self.paths = {}
+
+        self.target = None
+
+    def get_direction(self, grid_cell):
+        """
+        the direction to move from grid_cell, raises KeyError if
+        there is no way to the target from there.
+        """
+        return self.paths[grid_cell]
+
+    def get_distance(self, grid_cell):
+        """
+        the steps from grid_cell to the target, or None if it can't be
+        reached.
+        """
+        return self.distances.get(grid_cell)
+
+    def is_inside(self, grid_cell):
+        return (0 <= grid_cell[0] < self.grid.size[0] and
+                0 <= grid_cell[1] < self.grid.size[1])
+
+    def neighbours(self, grid_cell):
+        """
+        the neighbours of grid_cell inside the grid
+        """
+        for dire in self.grid.possible_dirs:
+            new_cell = (grid_cell[0] + dire[0], grid_cell[1] + dire[1])
+            if self.is_inside(new_cell):
+                yield new_cell
+
+    def calculate(self, target):
+        """
+        calculate the whole field with a breadth first search from
+        target.
+        """
+        self.target = target
+        self.distances = distances = {}
+        self.paths = {}
+
+        is_solid_at = self.grid.is_solid_at
+        if is_solid_at(target):
+            return
+
+        distances[target] = 0
+        q = deque([target])
+        while q:
+            cell = q.popleft()
+            new_distance = distances[cell] + 1
+            for new_cell in self.neighbours(cell):
+                if new_cell not in distances and not is_solid_at(new_cell):
+                    distances[new_cell] = new_distance
+                    q.append(new_cell)
+
+        for cell in distances:
+            self.update_direction(cell)
+        for cell in self.grid.get_solid_cells():
+            self.update_direction(cell)
+
+    def update_direction(self, grid_cell):
+        """
+        point grid_cell to its neighbour nearest to the target, or
+        forget its direction if it has no reachable neighbour.
+        """
+        if grid_cell == self.target:
+            return
+
+        distances = self.distances
+        best_dire, best_distance = None, None
+        for dire in self.grid.possible_dirs:
+            new_cell = (grid_cell[0] + dire[0], grid_cell[1] + dire[1])
+            distance = distances.get(new_cell)
+            if distance is not None and (best_distance is None or
+                                         distance < best_distance):
+                best_dire, best_distance = dire, distance
+
+        if best_dire is None:
+            self.paths.pop(grid_cell, None)
+        else:
+            self.paths[grid_cell] = best_dire
+
+    def repair(self, changed_cells):
+        """
+        update the field after the given cells became solid or free.
+
+        first the cells that can't reach the target as they used to
+        are forgotten, and then the distances are propagated from
+        their border and from the freed cells, like in a dijkstra.
+        """
+        distances = self.distances
+        is_solid_at = self.grid.is_solid_at
+        changed_distances = set()
+
+        # forget the cells that became solid, and all the cells that
+        # only got their distance through them:
+        lost = []
+        for cell in changed_cells:
+            if cell in distances and is_solid_at(cell):
+                heapq.heappush(lost, (distances.pop(cell), cell))
+                changed_distances.add(cell)
+
+        lost_cells = []
+        while lost:
+            distance, cell = heapq.heappop(lost)
+            for new_cell in self.neighbours(cell):
+                if distances.get(new_cell) != distance + 1:
+                    continue
+                is_supported = False
+                for support in self.neighbours(new_cell):
+                    if distances.get(support) == distance:
+                        is_supported = True
+                        break
+                if not is_supported:
+                    del distances[new_cell]
+                    heapq.heappush(lost, (distance + 1, new_cell))
+                    lost_cells.append(new_cell)
+                    changed_distances.add(new_cell)
+
+        # the forgotten and the freed cells get a new distance from
+        # their neighbours, then it spreads:
+        seeds = [cell for cell in changed_cells if not is_solid_at(cell)]
+        seeds.extend(lost_cells)
+
+        pending = []
+        for cell in seeds:
+            if cell == self.target:
+                distance = 0
+            else:
+                near = [distances[new_cell]
+                        for new_cell in self.neighbours(cell)
+                        if new_cell in distances]
+                if not near:
+                    continue
+                distance = min(near) + 1
+            if distance < distances.get(cell, distance + 1):
+                distances[cell] = distance
+                heapq.heappush(pending, (distance, cell))
+                changed_distances.add(cell)
+
+        while pending:
+            distance, cell = heapq.heappop(pending)
+            if distances.get(cell) != distance:
+                continue
+            new_distance = distance + 1
+            for new_cell in self.neighbours(cell):
+                if is_solid_at(new_cell):
+                    continue
+                old_distance = distances.get(new_cell)
+                if old_distance is None or new_distance < old_distance:
+                    distances[new_cell] = new_distance
+                    heapq.heappush(pending, (new_distance, new_cell))
+                    changed_distances.add(new_cell)
+
+        # only the cells next to a change can get a new direction:
+        to_update = set(changed_cells)
+        to_update.update(changed_distances)
+        for cell in list(to_update):
+            to_update.update(self.neighbours(cell))
+        for cell in to_update:
+            self.update_direction(cell)
+
+
+# direction code of the cells without a direction in ArrayFlowField:
+NO_DIRECTION = 255
+
+
+class ArrayFlowField(object):
+    """
+    a flow field stored in dense arrays indexed by y * width + x,
+    meant for very large grids.
+
+    the breadth first search advances a whole wavefront at a time, with
+    numpy if it is installed. the distances are kept in an array of
+    ints (-1 for the unreachable cells) and the directions as indexes
+    of the grid's possible_dirs in a bytearray, so the memory depends
+    on the number of cells and not on python objects.
+
+    it gives the same directions as FlowField, and it is repaired in
+    the same way, only where the distances change.
+
+    >>> from logic import ArrayGrid, Rock
+    >>> grid = ArrayGrid((6, 5))
+    >>> field = ArrayFlowField(grid)
+    >>> field.calculate((0, 2))
+    >>> all_cells = [(x, y) for x in range(6) for y in range(5)]
+    >>> def toggle(cells):
+    ...     for cell in cells:
+    ...         if grid.is_solid_at(cell):
+    ...             grid.remove(grid.get_at(cell))
+    ...         else:
+    ...             grid.add(Rock(), cell)
+    ...     field.repair(cells)
+    ...     fresh = FlowField(grid)
+    ...     fresh.calculate(field.target)
+    ...     return (field.paths == fresh.paths and
+    ...             map(field.get_distance, all_cells) ==
+    ...             map(fresh.get_distance, all_cells))
+    >>> import random
+    >>> rand = random.Random(0)
+    >>> all(toggle([(rand.randrange(6), rand.randrange(5))
+    ...             for i in range(rand.randint(1, 3))])
+    ...     for j in range(200))
+    True
+    """
+    def __init__(self, grid):
+        self.grid = grid
+        self.target = None
+
+        cells_number = grid.size[0] * grid.size[1]
+        self.distances = array('i', [-1]) * cells_number
+        self.directions = bytearray([NO_DIRECTION]) * cells_number
+
+    def get_direction(self, grid_cell):
+        """
+        the direction to move from grid_cell, raises KeyError if
+        there is no way to the target from there.
+        """
+        x, y = grid_cell
+        width, height = self.grid.size
+        if 0 <= x < width and 0 <= y < height:
+            code = self.directions[y * width + x]
+            if code != NO_DIRECTION:
+                return self.grid.possible_dirs[code]
+        raise KeyError(grid_cell)
+
+    def get_distance(self, grid_cell):
+        """
+        the steps from grid_cell to the target, or None if it can't be
+        reached.
+        """
+        x, y = grid_cell
+        width, height = self.grid.size
+        if 0 <= x < width and 0 <= y < height:
+            distance = self.distances[y * width + x]
+            if distance != -1:
+                return distance
+        return None
+
+    def get_paths(self):
+        """
+        the directions as a dict of grid cell -> direction, like the
+        paths of FlowField.
+        """
+        width = self.grid.size[0]
+        possible_dirs = self.grid.possible_dirs
+        paths = {}
+        for index, code in enumerate(self.directions):
+            if code != NO_DIRECTION:
+                paths[(index % width, index // width)] = possible_dirs[code]
+        return paths
+    paths = property(get_paths)
+
+    def calculate(self, target):
+        self.target = target
+        solid_mask = self.grid.get_solid_mask()
+        if numpy is not None:
+            self._calculate_numpy(target, solid_mask)
+        else:
+            self._calculate_python(target, solid_mask)
+
+    def neighbours(self, index):
+        """
+        the indexes of the neighbours of the cell at index, inside the
+        grid
+        """
+        width, height = self.grid.size
+        x, y = index % width, index // width
+        for dx, dy in self.grid.possible_dirs:
+            if 0 <= x + dx < width and 0 <= y + dy < height:
+                yield index + dy * width + dx
+
+    def update_direction(self, index, target_index):
+        """
+        point the cell at index to its neighbour nearest to the target,
+        or forget its direction if it has no reachable neighbour.
+        """
+        if index == target_index:
+            return
+
+        width, height = self.grid.size
+        x, y = index % width, index // width
+        distances = self.distances
+        best_code, best_distance = NO_DIRECTION, None
+        for code, (dx, dy) in enumerate(self.grid.possible_dirs):
+            if not (0 <= x + dx < width and 0 <= y + dy < height):
+                continue
+            distance = distances[index + dy * width + dx]
+            if distance != -1 and (best_distance is None or
+                                   distance < best_distance):
+                best_code, best_distance = code, distance
+        self.directions[index] = best_code
+
+    def repair(self, changed_cells):
+        """
+        update the arrays after the given cells became solid or free,
+        touching only the cells whose distance to the target changes,
+        like FlowField.repair.
+        """
+        width, height = self.grid.size
+        distances = self.distances
+        solid_mask = self.grid.get_solid_mask()
+        neighbours = self.neighbours
+        target_index = self.target[1] * width + self.target[0]
+        changed_indexes = [y * width + x for x, y in changed_cells
+                           if 0 <= x < width and 0 <= y < height]
+        changed_distances = set()
+
+        # forget the cells that became solid, and all the cells that
+        # only got their distance through them:
+        lost = []
+        for index in changed_indexes:
+            if distances[index] != -1 and solid_mask[index]:
+                heapq.heappush(lost, (distances[index], index))
+                distances[index] = -1
+                changed_distances.add(index)
+
+        lost_indexes = []
+        while lost:
+            distance, index = heapq.heappop(lost)
+            for new_index in neighbours(index):
+                if distances[new_index] != distance + 1:
+                    continue
+                is_supported = False
+                for support in neighbours(new_index):
+                    if distances[support] == distance:
+                        is_supported = True
+                        break
+                if not is_supported:
+                    distances[new_index] = -1
+                    heapq.heappush(lost, (distance + 1, new_index))
+                    lost_indexes.append(new_index)
+                    changed_distances.add(new_index)
+
+        # the forgotten and the freed cells get a new distance from
+        # their neighbours, then it spreads:
+        seeds = [index for index in changed_indexes
+                 if not solid_mask[index]]
+        seeds.extend(lost_indexes)
+
+        pending = []
+        for index in seeds:
+            if index == target_index:
+                distance = 0
+            else:
+                near = [distances[new_index]
+                        for new_index in neighbours(index)
+                        if distances[new_index] != -1]
+                if not near:
+                    continue
+                distance = min(near) + 1
+            if distances[index] == -1 or distance < distances[index]:
+                distances[index] = distance
+                heapq.heappush(pending, (distance, index))
+                changed_distances.add(index)
+
+        while pending:
+            distance, index = heapq.heappop(pending)
+            if distances[index] != distance:
+                continue
+            new_distance = distance + 1
+            for new_index in neighbours(index):
+                if solid_mask[new_index]:
+                    continue
+                old_distance = distances[new_index]
+                if old_distance == -1 or new_distance < old_distance:
+                    distances[new_index] = new_distance
+                    heapq.heappush(pending, (new_distance, new_index))
+                    changed_distances.add(new_index)
+
+        # only the cells next to a change can get a new direction:
+        to_update = set(changed_indexes)
+        to_update.update(changed_distances)
+        for index in list(to_update):
+            to_update.update(neighbours(index))
+        for index in to_update:
+            self.update_direction(index, target_index)
+
+    def _calculate_python(self, target, solid_mask):
+        width, height = self.grid.size
+        cells_number = width * height
+        distances = array('i', [-1]) * cells_number
+        directions = bytearray([NO_DIRECTION]) * cells_number
+        self.distances, self.directions = distances, directions
+
+        # flat index offset and the validity check of each direction:
+        offsets = []
+        for dx, dy in self.grid.possible_dirs:
+            offsets.append((dy * width + dx, dx, dy))
+
+        target_index = target[1] * width + target[0]
+        if solid_mask[target_index]:
+            return
+
+        distances[target_index] = 0
+        reached = [target_index]
+        frontier = [target_index]
+        distance = 0
+        while frontier:
+            distance += 1
+            new_frontier = []
+            for index in frontier:
+                x, y = index % width, index // width
+                for offset, dx, dy in offsets:
+                    if not (0 <= x + dx < width and 0 <= y + dy < height):
+                        continue
+                    new_index = index + offset
+                    if distances[new_index] == -1 and \
+                            not solid_mask[new_index]:
+                        distances[new_index] = distance
+                        new_frontier.append(new_index)
+            reached.extend(new_frontier)
+            frontier = new_frontier
+
+        to_point = reached
+        to_point.extend(index for index in xrange(cells_number)
+                        if solid_mask[index])
+        for index in to_point:
+            if index == target_index:
+                continue
+            x, y = index % width, index // width
+            best_code, best_distance = NO_DIRECTION, None
+            for code, (offset, dx, dy) in enumerate(offsets):
+                if not (0 <= x + dx < width and 0 <= y + dy < height):
+                    continue
+                new_distance = distances[index + offset]
+                if new_distance != -1 and (best_distance is None or
+                                           new_distance < best_distance):
+                    best_code, best_distance = code, new_distance
+            directions[index] = best_code
+
+    def _calculate_numpy(self, target, solid_mask):
+        width, height = self.grid.size
+        cells_number = width * height
+        solid = numpy.frombuffer(solid_mask, dtype=numpy.uint8) \
+            .astype(bool)
+        distances = numpy.full(cells_number, -1, dtype=numpy.int32)
+
+        target_index = target[1] * width + target[0]
+        if not solid[target_index]:
+            distances[target_index] = 0
+            # the cells not reached yet, cleared as the wavefront
+            # passes, so each cell enters the frontier only once
+            # without sorting it:
+            unvisited = ~solid
+            unvisited[target_index] = False
+            frontier = numpy.array([target_index], dtype=numpy.intp)
+            distance = 0
+            while frontier.size:
+                distance += 1
+                x = frontier % width
+                reached = []
+                for cells in (frontier[x > 0] - 1,
+                              frontier[x < width - 1] + 1,
+                              frontier[frontier >= width] - width,
+                              frontier[frontier < cells_number - width] +
+                              width):
+                    cells = cells[unvisited[cells]]
+                    unvisited[cells] = False
+                    reached.append(cells)
+                frontier = numpy.concatenate(reached)
+                distances[frontier] = distance
+
+        # the distance of the neighbour in each direction, the cells
+        # outside the grid or unreachable count as infinitely far:
+        unreachable = numpy.iinfo(numpy.int32).max
+        grid_distances = numpy.where(distances == -1, unreachable,
+                                     distances).reshape(height, width)
+        best_distance = numpy.full((height, width), unreachable,
+                                   dtype=numpy.int32)
+        codes = numpy.full((height, width), NO_DIRECTION,
+                           dtype=numpy.uint8)
+        for code, (dx, dy) in enumerate(self.grid.possible_dirs):
+            neighbour = numpy.full((height, width), unreachable,
+                                   dtype=numpy.int32)
+            neighbour[max(-dy, 0):height - max(dy, 0),
+                      max(-dx, 0):width - max(dx, 0)] = \
+                grid_distances[max(dy, 0):height - max(-dy, 0),
+                               max(dx, 0):width - max(-dx, 0)]
+            is_better = neighbour < best_distance
+            best_distance[is_better] = neighbour[is_better]
+            codes[is_better] = code
+
+        codes = codes.reshape(cells_number)
+        # non solid cells without a reachable neighbour are already
+        # unreachable, so only the target needs to be cleared:
+        codes[target_index] = NO_DIRECTION
+
+        self.distances = array('i', distances.tostring())
+        self.directions = bytearray(codes.tostring())
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -11,7 +11,7 @@ from cocos.director import director
 from cocos.menu import Menu, ImageMenuItem, LEFT, CENTER, \
      zoom_in, zoom_out
 
-from veronica_logic import CommonTower, HardTower
+from veronica_logic import CommonTower, HardTower, SplashTower
 
 from utils import get_cell_from_point
 from settings import GRID_CELL, GRID_SIZE
@@ -20,6 +20,8 @@ from settings import GRID_CELL, GRID_SIZE
 images_for_sprites = {
     CommonTower: 'common_tower_head.png',
     HardTower: 'hard_tower_head.png',
+    # the head of its sprite in the world:
+    SplashTower: 'impact.png',
     }
 
 
@@ -35,7 +37,7 @@ class HudLayer(Menu):
         self.mouse_x, self.mouse_y = None, None
         
         items = []
-        towers = [CommonTower, HardTower]
+        towers = [CommonTower, HardTower, SplashTower]
         for tower in towers:
             item = ImageMenuItem(images_for_sprites[tower], 
                                  getattr(self, 'on_tower_callback'),
@@ -8,16 +8,20 @@ from cocos.director import director
 
 from pyglet.window import mouse, key
 
-from veronica_logic import Tower
+from veronica_logic import Tower, Enemy
 from sprites import WorldSprite, TowerSprite, CommonTowerSprite, \
      HardTowerSprite, EnemySprite, CommonEnemySprite, FastEnemySprite, \
-     HqSprite, all_sprites, InfoSprite
+     HqSprite, RockSprite, all_sprites, InfoSprite, ShotSprites
 
 from split_layer import SplitLayer, split_horizontal, split_vertical
 from hud_layer import HudLayer
+from performance_layer import PerformanceLayer
+from batch_layer import BatchLayer
+from static_layer import StaticLayer
+from lifebar_sprite import LifeBars
 from cocos.rect import Rect
 
-from utils import get_cell_from_point
+from utils import get_cell_from_point, Recycler
 import settings
 
 
@@ -27,11 +31,26 @@ for sprite in all_sprites:
     sprite_per_object[sprite.world_object_class] = sprite
 
 
+def set_paused(node, is_paused):
+    """
+    pause or resume the actions and the scheduled calls of the node
+    and all its children
+    """
+    if is_paused:
+        node.pause()
+        node.pause_scheduler()
+    else:
+        node.resume()
+        node.resume_scheduler()
+    for child in node.get_children():
+        set_paused(child, is_paused)
+
 
 
-class BackgroundLayer(ColorLayer):
+class BackgroundLayer(StaticLayer):
     def __init__(self):
-        super(BackgroundLayer, self).__init__(255, 255, 255, 255)
+        super(BackgroundLayer, self).__init__()
+        self.add(ColorLayer(255, 255, 255, 255))
         
         # wall tile (120 x 120 px):
         for i in range(0, settings.WINDOW_SIZE[0], 120):
@@ -45,9 +64,10 @@ class BackgroundLayer(ColorLayer):
 class ControlLayer(Layer):
     is_event_handler = True
     
-    def __init__(self, level):
+    def __init__(self, level, performance_layer):
         super(ControlLayer, self).__init__()
         self.level = level
+        self.performance_layer = performance_layer
     
     def on_mouse_press(self, x, y, buttons, modifiers):
         vx, vy = director.get_virtual_coordinates(x,y)
@@ -66,6 +86,38 @@ class ControlLayer(Layer):
                 self.level.world.activate_tower(world_obj)
             else:
                 self.level.world.deactivate_tower()
+    
+    # key -> speed of the game:
+    speed_keys = {
+        key._1: 1,
+        key._2: 2,
+        key._3: 4,
+        key._4: 16,
+        }
+    
+    def on_key_press(self, symbol, modifiers):
+        if symbol in self.speed_keys:
+            self.level.clock.set_speed(self.speed_keys[symbol])
+            return True
+        elif symbol == key.SPACE:
+            self.toggle_pause()
+            return True
+        elif symbol == key.P:
+            self.performance_layer.toggle()
+            return True
+    
+    def toggle_pause(self):
+        """
+        pause or resume the clock of the level. the enemies and the
+        towers follow the clock, the animations of the scene (the
+        shots, the turns, the deaths) are paused with it.
+        """
+        clock = self.level.clock
+        if clock.is_paused:
+            clock.resume()
+        else:
+            clock.pause()
+        set_paused(director.scene, clock.is_paused)
 
 
 class WorldLayer(SplitLayer):
@@ -78,26 +130,57 @@ class WorldLayer(SplitLayer):
         self.world = world
         world.add_listener(self)
         
-        self.towers_layer = Layer()
-        self.enemies_layer = Layer()
-        self.shots_layer = Layer()
+        if settings.BATCHED_SPRITES:
+            layer_class = BatchLayer
+        else:
+            layer_class = Layer
+        self.towers_layer = layer_class()
+        self.enemies_layer = layer_class()
+        self.shots_layer = layer_class()
+        # the rocks and the hq don't change during the level:
+        self.static_layer = StaticLayer()
+        self.add(self.static_layer, z=0)
         self.add(self.towers_layer, z=0)
         self.add(self.enemies_layer, z=1)
         self.add(self.shots_layer, z=2)
+        self.shot_sprites = ShotSprites(self.shots_layer)
+        
+        # the enemy sprites to reuse:
+        self.enemy_sprites = Recycler()
+        
+        # drawn over the enemies:
+        self.life_bars = LifeBars()
+        self.add(self.life_bars, z=1)
         
         self.layers_per_sprites = {
             TowerSprite: self.towers_layer,
             EnemySprite: self.enemies_layer,
+            RockSprite: self.static_layer,
+            HqSprite: self.static_layer,
             }
         
-        self.schedule_interval(world.update, 1.0/settings.FPS)
+        self.schedule(self.follow_world)
+    
+    def follow_world(self, dt):
+        """
+        called each frame, show the enemies and the towers where the
+        world moved and turned them with its clock
+        """
+        for enemy in self.world.enemies:
+            enemy.sprite.follow(enemy)
+        for tower in self.world.towers:
+            tower.sprite.follow(tower)
     
     def make_sprite(self, sprite_class, world_obj, *args, **kwargs):
         """
         make a sprite that represents the world object and add it to
         the corresponding layer.
         """
-        sprite = sprite_class(world_obj, *args, **kwargs)
+        if issubclass(sprite_class, EnemySprite):
+            sprite = self.enemy_sprites.get(sprite_class, world_obj,
+                                            *args, **kwargs)
+        else:
+            sprite = sprite_class(world_obj, *args, **kwargs)
         
         layer = self
         for sp_class, sp_layer in self.layers_per_sprites.items():
@@ -116,7 +199,10 @@ class WorldLayer(SplitLayer):
         
         kwargs = {}
         if isinstance(world_obj, Tower):
-            kwargs['shots_layer'] = self.shots_layer
+            kwargs['shot_sprites'] = self.shot_sprites
+        elif isinstance(world_obj, Enemy):
+            kwargs['recycler'] = self.enemy_sprites
+            kwargs['life_bars'] = self.life_bars
         
         self.make_sprite(sprite_class, world_obj, **kwargs)
     
@@ -167,22 +253,21 @@ class LevelScene(Scene):
         
         hud_layer.add(HudLayer(level))
         
-        control_layer = ControlLayer(level)
+        performance_layer = PerformanceLayer(world_layer)
+        control_layer = ControlLayer(level, performance_layer)
         
         self.add(bg_layer, z=0)
         self.add(world_layer, z=1)
         self.add(hud_layer, z=2)
         self.add(info_layer, z=3)
         self.add(control_layer, z=4)
+        self.add(performance_layer, z=5)
         
-        self.schedule_interval(level.spawn_enemy, settings.SPAWN_SECS)
+        self.schedule_interval(level.update, 1.0/settings.FPS)
         level.start()
         
         info_layer.setup(level.world.hq, level.resources)
     
-    def on_stop_spawning(self, level, *args):
-        self.unschedule(level.spawn_enemy)
-    
     def on_done(self, level, user_success):
         """
         when this level is done, return to the level selector
@@ -1,62 +1,171 @@
+import heapq
+
+import pyglet
 from cocos.cocosnode import CocosNode
 
 from pyglet.gl import *
 
+
+class LifeBars(CocosNode):
+    """
+    the life bars of all the enemies, drawn from one vertex list in a
+    single draw call.
+
+    each life bar has a slot of 8 vertices in the list, 4 for its
+    container and 4 for the bar, that is only rewritten when the lives
+    or the position of its enemy change: the life bar is marked dirty
+    then, and only the dirty slots are written in the next frame. the
+    free slots are empty quads, and they are reused for the next life
+    bars.
+    """
+    # vertices of each slot:
+    slot_vertices = 8
+
+    def __init__(self, capacity=64):
+        super(LifeBars, self).__init__()
+
+        self.vertex_list = pyglet.graphics.vertex_list(
+            capacity * self.slot_vertices, 'v2f/stream', 'c4B/static')
+
+        # slot -> life bar, None for the free slots:
+        self.bars = []
+        self.free = []
+
+        # the free slots not emptied in the vertex list yet:
+        self.cleared = []
+
+        # the life bars to write in the next frame:
+        self.dirty = set()
+
+        self.capacity = 0
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        """
+        make room for capacity life bars
+        """
+        self.vertex_list.resize(capacity * self.slot_vertices)
+        colors = (list(LifeBarSprite.container_color) * 4 +
+                  list(LifeBarSprite.bar_color) * 4)
+        self.vertex_list.colors[:] = colors * capacity
+
+        extra = range(self.capacity, capacity)
+        self.bars.extend([None] * len(extra))
+        self.cleared.extend(extra)
+        for slot in extra:
+            heapq.heappush(self.free, slot)
+        self.capacity = capacity
+
+    def add(self, life_bar):
+        if not self.free:
+            self.grow(self.capacity * 2)
+        slot = heapq.heappop(self.free)
+        self.bars[slot] = life_bar
+        life_bar.slot = slot
+        self.dirty.add(life_bar)
+
+    def remove(self, life_bar):
+        slot = life_bar.slot
+        self.bars[slot] = None
+        self.dirty.discard(life_bar)
+        self.cleared.append(slot)
+        heapq.heappush(self.free, slot)
+        life_bar.slot = None
+
+    def draw(self):
+        if self.dirty or self.cleared:
+            vertices = self.vertex_list.vertices
+            slot_floats = self.slot_vertices * 2
+            for slot in self.cleared:
+                start = slot * slot_floats
+                vertices[start:start + slot_floats] = [0.0] * slot_floats
+            self.cleared = []
+            # the bars whose enemy moved or got hurt since the last
+            # frame:
+            for life_bar in self.dirty:
+                start = life_bar.slot * slot_floats
+                vertices[start:start + slot_floats] = \
+                    life_bar.get_vertices()
+            self.dirty.clear()
+
+        self.vertex_list.draw(GL_QUADS)
+
+
 class LifeBarSprite(CocosNode):
-    """Dinamic Lifebar, using gl primitives""" 
+    """
+    dinamic lifebar of an enemy, drawn by the shared life bars while
+    it is in the scene
+    """
     container_width = 25
     max_height = 50
     container_color = (0, 0, 0, 50)
     bar_color = (255, 0, 0, 100)
     container_height = 2
     bar_height = 2
-    
-    container_vertex = [(0, 0, 0),
-                        (container_width, 0, 0),
-                        (container_width, container_height, 0),
-                        (0, container_height, 0 )]
-    
-    def __init__(self, enemy):
+
+    def __init__(self, enemy, life_bars):
         super(LifeBarSprite, self).__init__()
-        
-        # the lifebar will listen to the enemy:
-        enemy.add_listener(self)
-        
-        self.max_lives = enemy.initial_lives
-        self.x = -(self.container_width / 2) 
+
+        self.life_bars = life_bars
+
+        # the slot in the life bars, while it is in the scene:
+        self.slot = None
+
+        self.x = -(self.container_width / 2)
         self.y = self.max_height / 2 + 5
-        
-        self.on_get_hurt(enemy)
-    
-    def draw(self):
+
+        # the life bars draw it, it isn't drawn by itself:
+        self.visible = False
+
+        self.reset(enemy)
+
+    def reset(self, enemy):
         """
-        this is used by cocos, to draw the primitives
+        show the lives of enemy, also to reuse the lifebar for another
+        enemy
         """
-        self.gl_draw([(self.container_vertex, self.container_color),
-                      (self.bar_vertex, self.bar_color)])
-    
+        # the lifebar will listen to the enemy:
+        enemy.add_listener(self, weak=True)
+
+        self.max_lives = enemy.initial_lives
+        self.on_get_hurt(enemy)
+
+    def on_enter(self):
+        super(LifeBarSprite, self).on_enter()
+        self.life_bars.add(self)
+
+    def on_exit(self):
+        super(LifeBarSprite, self).on_exit()
+        self.life_bars.remove(self)
+
     def on_get_hurt(self, enemy, *args):
         """
-        updates position and lives of the target, and re-define te
-        vertex points
+        updates the lives of the target, the life bars write them in
+        the next frame
         """
         self.bar_width = (enemy.lives*self.container_width)/self.max_lives
-        
-        self.bar_vertex = [(0, 0, 0),
-                           (self.bar_width, 0, 0),
-                           (self.bar_width, self.bar_height, 0),
-                           (0, self.bar_height, 0)]
+        self.invalidate()
     
-    def gl_draw(self, draw_list):
-        """
-        takes a List of tuples like (vertexList, color) and draw them
-        """
-        glPushMatrix()
-        for vertexes, color in draw_list:
-            glBegin(GL_QUADS)
-            glColor4ub(*color)
-            for v in vertexes:
-                vertex = (v[0]+self.x, v[1]+self.y, v[2])
-                glVertex3f(*vertex)
-            glEnd()
-        glPopMatrix()
+    def invalidate(self):
+        """
+        write the life bar again in the next frame, when the lives or
+        the position of the enemy change
+        """
+        if self.slot is not None:
+            self.life_bars.dirty.add(self)
+
+    def get_vertices(self):
+        """
+        the corners of the container and the bar, next to the enemy
+        """
+        enemy_x, enemy_y = self.parent.position
+        x = enemy_x + self.x
+        y = enemy_y + self.y
+        container_x = x + self.container_width
+        bar_x = x + self.bar_width
+        return [x, y, container_x, y,
+                container_x, y + self.container_height,
+                x, y + self.container_height,
+                x, y, bar_x, y,
+                bar_x, y + self.bar_height,
+                x, y + self.bar_height]
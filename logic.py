@@ -5,12 +5,26 @@ general tower defense logic
 """
 
 import math
-import time
 import random
+import itertools
+import collections
+from array import array
+from operator import attrgetter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import settings
-from notifier import Notifier, notify
-from utils import angle_difference
+from notifier import Notifier, EventBuffer, notify, notify_changes
+from flow_field import FlowField, ArrayFlowField
+from enemy_pool import EnemyPool
+from shot_pool import ShotPool
+from spatial_hash import SpatialHash
+from targeting import find_targets
+from utils import angle_difference, OrderedSet, Recycler
+from clock import Clock
 
 
 class Grid(object):
@@ -30,6 +44,17 @@ class Grid(object):
         self.grid = {}
         self.solids = {}
         
+        # the solids as a bytearray, built the first time it is asked
+        # for and then kept up to date:
+        self.solid_mask = None
+        
+        # world object -> (cells it fills, is it solid), so removing
+        # or moving an object only touches its own cells:
+        self.objects = {}
+        
+        # grid position -> towers that can see it:
+        self.coverage = {}
+        
         self.size = size
     
     def is_empty_at(self, grid_cell):
@@ -60,6 +85,33 @@ class Grid(object):
     
     def get_solid_cells(self):
         return self.solids.keys()
+    
+    def get_solid_mask(self):
+        """
+        a bytearray with 1 for each solid cell and 0 for the rest,
+        indexed by y * width + x. it is updated when the solids change,
+        and must not be changed by the caller.
+        """
+        if self.solid_mask is None:
+            self.solid_mask = bytearray(self.size[0] * self.size[1])
+            self.set_solid_mask(self.solids, 1)
+        return self.solid_mask
+    
+    def set_solid_mask(self, cells, value):
+        """
+        write value in the solid mask for the cells inside the grid
+        """
+        width, height = self.size
+        solid_mask = self.solid_mask
+        for x, y in cells:
+            if 0 <= x < width and 0 <= y < height:
+                solid_mask[y * width + x] = value
+    
+    def get_cells(self, world_obj):
+        """
+        the cells filled by world_obj
+        """
+        return self.objects[world_obj][0]
 
     def is_out_at(self, world_object_class, grid_pos):
         """
@@ -96,40 +148,59 @@ class Grid(object):
         """
         assert(self.can_fit_at(world_obj.__class__, grid_pos))
         
-        is_solid = False
-        for solid_class in solid_classes:
-            if isinstance(world_obj, solid_class):
-                is_solid = True
+        is_solid = is_solid_object(world_obj)
         
+        cells = []
         for x in range(world_obj.size[0]):
             for y in range(world_obj.size[1]):
                 cell = grid_pos[0] + x, grid_pos[1] + y
-                if self.grid.get(cell) is None:
-                    self.grid[cell] = set([world_obj])
-                else:
-                    self.grid[cell].add(world_obj)
-                if is_solid:
-                    self.solids[cell] = world_obj
+                self.add_to_cell(world_obj, cell)
+                cells.append(cell)
+        if is_solid:
+            self.add_solid(world_obj, cells)
         
+        self.objects[world_obj] = (cells, is_solid)
         world_obj.grid_pos = grid_pos
     
     def remove(self, world_obj):
         """
         remove world_obj emptying the grid.
         """
-        is_solid = False
-        for solid_class in solid_classes:
-            if isinstance(world_obj, solid_class):
-                is_solid = True
+        cells, is_solid = self.objects.pop(world_obj)
         
         world_obj.grid_pos = None
-        for grid_cell, world_objs_set in self.grid.items():
-            if world_obj in world_objs_set:
-                self.grid[grid_cell].remove(world_obj)
-                if len(world_objs_set) == 0:
-                    del self.grid[grid_cell]
-                if is_solid:
-                    del self.solids[grid_cell]
+        for grid_cell in cells:
+            self.remove_from_cell(world_obj, grid_cell)
+        if is_solid:
+            self.remove_solid(cells)
+    
+    def add_to_cell(self, world_obj, grid_cell):
+        world_objs_set = self.grid.get(grid_cell)
+        if world_objs_set is None:
+            self.grid[grid_cell] = set([world_obj])
+        else:
+            world_objs_set.add(world_obj)
+    
+    def remove_from_cell(self, world_obj, grid_cell):
+        world_objs_set = self.grid[grid_cell]
+        world_objs_set.remove(world_obj)
+        if len(world_objs_set) == 0:
+            del self.grid[grid_cell]
+    
+    def add_solid(self, world_obj, cells):
+        """
+        mark the cells as filled by the solid world_obj
+        """
+        for cell in cells:
+            self.solids[cell] = world_obj
+        if self.solid_mask is not None:
+            self.set_solid_mask(cells, 1)
+    
+    def remove_solid(self, cells):
+        for cell in cells:
+            del self.solids[cell]
+        if self.solid_mask is not None:
+            self.set_solid_mask(cells, 0)
     
     def move(self, world_object, new_pos):
         """
@@ -137,6 +208,326 @@ class Grid(object):
         """
         self.remove(world_object)
         self.add(world_object, new_pos)
+    
+    def add_coverage(self, tower, cells):
+        """
+        mark the cells as seen by tower
+        """
+        for cell in cells:
+            towers = self.coverage.get(cell)
+            if towers is None:
+                self.coverage[cell] = set([tower])
+            else:
+                towers.add(tower)
+    
+    def remove_coverage(self, tower, cells):
+        """
+        the cells aren't seen by tower anymore
+        """
+        for cell in cells:
+            towers = self.coverage[cell]
+            towers.remove(tower)
+            if len(towers) == 0:
+                del self.coverage[cell]
+    
+    def get_towers_covering(self, cells):
+        """
+        return the set of towers that can see any of the cells
+        """
+        towers = set()
+        for cell in cells:
+            cell_towers = self.coverage.get(cell)
+            if cell_towers is not None:
+                towers.update(cell_towers)
+        return towers
+
+
+class CellsView(collections.Mapping):
+    """
+    a read only dict of grid cell -> value, over the flat arrays of an
+    ArrayGrid. get_value gives the value of an index of the arrays, or
+    None if the cell isn't in the dict.
+    """
+    def __init__(self, grid, get_value):
+        self.grid = grid
+        self.get_value = get_value
+    
+    def __getitem__(self, grid_cell):
+        index = self.grid.get_index(grid_cell)
+        value = None if index is None else self.get_value(index)
+        if value is None:
+            raise KeyError(grid_cell)
+        return value
+    
+    def __iter__(self):
+        width, height = self.grid.size
+        for index in xrange(width * height):
+            if self.get_value(index) is not None:
+                yield (index % width, index // width)
+    
+    def __len__(self):
+        return sum(1 for grid_cell in self)
+
+
+class ArrayGrid(Grid):
+    """
+    a grid that keeps the number of objects in each cell and the solid
+    cells in flat arrays, and the objects of each cell in a flat list,
+    indexed by y * width + x, instead of dicts. the cells outside the
+    grid aren't kept.
+
+    the queries read the arrays, and get_placement_mask answers where
+    a world object class fits in the whole grid at once (with numpy, if
+    it is installed). the grid and solids dicts of Grid are read only
+    views of the arrays.
+
+    >>> grid = ArrayGrid((4, 3))
+    >>> rock = Rock()
+    >>> grid.add(rock, (1, 1))
+    >>> print grid.is_solid_at((1, 1)), grid.is_empty_at((1, 1))
+    True False
+    >>> print grid.get_at((1, 1)) is rock, grid.solids[(1, 1)] is rock
+    True True
+    >>> print grid.grid.keys(), grid.occupancy[1 * 4 + 1]
+    [(1, 1)] 1
+    >>> print grid.can_fit_at(Tower, (0, 0)), grid.can_fit_at(Tower, (2, 0))
+    False True
+    >>> mask = grid.get_placement_mask(Tower)
+    >>> for y in range(3):
+    ...     print list(mask[y * 4:(y + 1) * 4])
+    [0, 0, 1, 0]
+    [0, 0, 1, 0]
+    [0, 0, 0, 0]
+    >>> grid.remove(rock)
+    >>> print grid.is_empty_at((1, 1)), grid.solids.get((1, 1))
+    True None
+    """
+    def __init__(self, size):
+        super(ArrayGrid, self).__init__(size)
+        cells_number = size[0] * size[1]
+        
+        # the number of world objects in each cell:
+        self.occupancy = array('I', [0]) * cells_number
+        # the set of world objects in each cell, None if it is empty:
+        self.cell_objects = [None] * cells_number
+        # 1 if the cell has a solid, 0 if not:
+        self.solid_mask = bytearray(cells_number)
+        
+        self.grid = CellsView(self, self.cell_objects.__getitem__)
+        self.solids = CellsView(self, self.get_solid_at)
+    
+    def get_index(self, grid_cell):
+        """
+        the index of the grid cell in the arrays, or None if the cell
+        is outside the grid
+        """
+        x, y = grid_cell
+        if 0 <= x < self.size[0] and 0 <= y < self.size[1]:
+            return y * self.size[0] + x
+        return None
+    
+    def get_solid_at(self, index):
+        """
+        the solid world object in the cell of the index, or None
+        """
+        if self.solid_mask[index]:
+            for world_obj in self.cell_objects[index]:
+                if is_solid_object(world_obj):
+                    return world_obj
+        return None
+    
+    def is_empty_at(self, grid_cell):
+        index = self.get_index(grid_cell)
+        return index is None or self.occupancy[index] == 0
+    
+    def get_at(self, grid_cell):
+        index = self.get_index(grid_cell)
+        if index is None:
+            return None
+        result = self.cell_objects[index]
+        if result is not None and len(result) == 1:
+            return list(result)[0]
+        return result
+    
+    def get_filled_cells(self):
+        width = self.size[0]
+        return [(index % width, index // width)
+                for index, count in enumerate(self.occupancy) if count]
+    
+    def add_to_cell(self, world_obj, grid_cell):
+        index = self.get_index(grid_cell)
+        if index is None:
+            return
+        world_objs_set = self.cell_objects[index]
+        if world_objs_set is None:
+            self.cell_objects[index] = set([world_obj])
+        else:
+            world_objs_set.add(world_obj)
+        self.occupancy[index] += 1
+    
+    def remove_from_cell(self, world_obj, grid_cell):
+        index = self.get_index(grid_cell)
+        if index is None:
+            return
+        world_objs_set = self.cell_objects[index]
+        world_objs_set.remove(world_obj)
+        if len(world_objs_set) == 0:
+            self.cell_objects[index] = None
+        self.occupancy[index] -= 1
+    
+    def is_solid_at(self, grid_cell):
+        index = self.get_index(grid_cell)
+        return index is not None and self.solid_mask[index] == 1
+    
+    def can_fit_at(self, world_object_class, grid_pos):
+        width = self.size[0]
+        solid_mask = self.solid_mask
+        min_x, min_y = max(grid_pos[0], 0), max(grid_pos[1], 0)
+        max_x = min(grid_pos[0] + world_object_class.size[0], width)
+        max_y = min(grid_pos[1] + world_object_class.size[1], self.size[1])
+        for y in range(min_y, max_y):
+            row = y * width
+            if 1 in solid_mask[row + min_x:row + max_x]:
+                return False
+        return True
+    
+    def add_solid(self, world_obj, cells):
+        self.set_solid_mask(cells, 1)
+    
+    def remove_solid(self, cells):
+        self.set_solid_mask(cells, 0)
+    
+    def get_solid_cells(self):
+        width = self.size[0]
+        return [(index % width, index // width)
+                for index, solid in enumerate(self.solid_mask) if solid]
+    
+    def get_placement_mask(self, world_object_class):
+        """
+        return a bytearray, indexed like the grid arrays, with 1 in
+        every top left position where a world object of the given
+        class can fit without being out of the grid.
+        
+        it uses a summed area table of the solid cells, so the cost
+        doesn't depend on the size of the world object class.
+        """
+        width, height = self.size
+        obj_width, obj_height = world_object_class.size
+        if obj_width > width or obj_height > height:
+            return bytearray(width * height)
+        if numpy is not None:
+            return self._get_placement_mask_numpy(obj_width, obj_height)
+        solid_mask = self.solid_mask
+        
+        # sums[(y + 1) * (width + 1) + x + 1] is the number of solid
+        # cells in the rectangle from (0, 0) to (x, y), inclusive:
+        row_len = width + 1
+        sums = array('I', [0]) * (row_len * (height + 1))
+        for y in range(height):
+            row_sum = 0
+            row = y * width
+            above = y * row_len
+            current = above + row_len
+            for x in range(width):
+                row_sum += solid_mask[row + x]
+                sums[current + x + 1] = sums[above + x + 1] + row_sum
+        
+        mask = bytearray(width * height)
+        for y in range(height - obj_height + 1):
+            top = y * row_len
+            bottom = (y + obj_height) * row_len
+            row = y * width
+            for x in range(width - obj_width + 1):
+                right = x + obj_width
+                solids = (sums[bottom + right] - sums[top + right] -
+                          sums[bottom + x] + sums[top + x])
+                if solids == 0:
+                    mask[row + x] = 1
+        return mask
+    
+    def _get_placement_mask_numpy(self, obj_width, obj_height):
+        width, height = self.size
+        solid = numpy.frombuffer(self.solid_mask, dtype=numpy.uint8)
+        solid = solid.reshape(height, width)
+        
+        # the same summed area table, with cumsum over both axes:
+        sums = numpy.zeros((height + 1, width + 1), dtype=numpy.int32)
+        sums[1:, 1:] = solid.cumsum(axis=0, dtype=numpy.int32).cumsum(axis=1)
+        
+        rows = height - obj_height + 1
+        columns = width - obj_width + 1
+        solids = (sums[obj_height:, obj_width:] -
+                  sums[:rows, obj_width:] -
+                  sums[obj_height:, :columns] +
+                  sums[:rows, :columns])
+        mask = numpy.zeros((height, width), dtype=numpy.uint8)
+        mask[:rows, :columns] = solids == 0
+        return bytearray(mask.tostring())
+
+
+# name of the backend (in the settings) -> grid class:
+grid_backends = {
+    'dict': Grid,
+    'array': ArrayGrid,
+}
+
+# name of the backend (in the settings) -> flow field class:
+flow_field_backends = {
+    'dict': FlowField,
+    'array': ArrayFlowField,
+}
+
+
+class CommandBuffer(object):
+    """
+    while active (in a with statement), records the changes to the
+    world to apply them together when it ends, so the collections
+    being updated don't change in the middle of the update. while not
+    active, the changes are applied at once.
+    
+    >>> commands = CommandBuffer()
+    >>> enemies = [1, 2, 3]
+    >>> with commands:
+    ...     for enemy in enemies:
+    ...         if enemy % 2:
+    ...             commands.add(enemies.remove, enemy)
+    ...     print enemies
+    [1, 2, 3]
+    >>> print enemies
+    [2]
+    >>> commands.add(enemies.remove, 2)
+    >>> print enemies
+    []
+    """
+    def __init__(self):
+        self.is_active = False
+        
+        # (function, args, kwargs) to call, in order:
+        self.pending = []
+    
+    def __enter__(self):
+        self.is_active = True
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.is_active = False
+        self.apply()
+    
+    def add(self, func, *args, **kwargs):
+        if self.is_active:
+            self.pending.append((func, args, kwargs))
+        else:
+            func(*args, **kwargs)
+    
+    def apply(self):
+        """
+        call the pending functions, the ones that they add are called
+        at once.
+        """
+        pending = self.pending
+        self.pending = []
+        for func, args, kwargs in pending:
+            func(*args, **kwargs)
 
 
 class World(Notifier):
@@ -145,16 +536,62 @@ class World(Notifier):
 
     it notifies changes so the GUI can be updated.
     """
-    def __init__(self, grid_size):
+    def __init__(self, grid_size, grid_class=Grid,
+                 flow_field_class=FlowField):
         super(World, self).__init__()
         
-        self.grid = Grid(grid_size)
+        self.grid = grid_class(grid_size)
+        self.flow_field = flow_field_class(self.grid)
+        
+        self.towers = OrderedSet()
+        self.enemies = OrderedSet()
+        
+        # the lives and the movement of the enemies:
+        self.enemy_pool = EnemyPool()
+        
+        # the shots flying to their targets:
+        self.shots = ShotPool()
         
-        self.towers = set()
-        self.enemies = set()
+        # to find the enemies near a point:
+        self.enemy_hash = SpatialHash()
+        
+        # the simulated time, that advances in fixed steps:
+        self.clock = Clock(step=1.0 / settings.FPS)
         
         self.hq = None
         self.active_tower = None
+        
+        # to know which enemy got in sight of a tower first:
+        self.sight_order = itertools.count()
+        
+        # if True, the targets of all the towers are found together in
+        # each update, instead of each tower looking for its own:
+        self.batch_targeting = False
+        
+        # tower -> (enemy, distance, angle), while updating in batch
+        # targeting mode:
+        self.targets = None
+        
+        # the updates of each frame are notified once, at the end:
+        self.event_buffer = EventBuffer()
+        
+        # the damage, the deaths, the enemies that reach the hq and the
+        # spawns during an update are applied at its end:
+        self.commands = CommandBuffer()
+        
+        # if True, the world moves the enemies and turns the towers by
+        # itself, with its clock, and the GUI only shows them. if
+        # False, they only move when they are told to.
+        self.simulates_motion = False
+        
+        # the objects that left the world, to forget their listeners
+        # once the notifications of their leaving are done:
+        self.left_objects = []
+        
+        # if True, the enemies that left the world are kept in the
+        # recycler once forgotten, to reuse them in the next spawns:
+        self.recycles_enemies = False
+        self.enemy_recycler = Recycler()
     
     @notify
     def add(self, world_obj, grid_pos):
@@ -167,20 +604,147 @@ class World(Notifier):
         
         self.grid.add(world_obj, grid_pos)
         world_obj.enter_world(self)
+        
+        if isinstance(world_obj, Tower):
+            self.add_tower_coverage(world_obj)
+        elif isinstance(world_obj, Enemy):
+            self.enemy_pool.add(world_obj)
+            self.enemy_hash.add(world_obj, grid_pos)
+            self.update_coverage(world_obj, (),
+                                 self.grid.get_cells(world_obj))
     
     @notify
     def remove(self, world_obj):
         if isinstance(world_obj, Tower):
             self.towers.remove(world_obj)
+            self.grid.remove_coverage(world_obj, world_obj.covered_cells)
+            world_obj.enemies_in_range = {}
         elif isinstance(world_obj, Enemy):
             self.enemies.remove(world_obj)
+            self.enemy_pool.remove(world_obj)
+            self.enemy_hash.remove(world_obj)
+            self.shots.forget_target(world_obj)
+            self.update_coverage(world_obj,
+                                 self.grid.get_cells(world_obj), ())
         
         self.grid.remove(world_obj)
         world_obj.leave_world()
     
+    def move(self, world_obj, new_pos):
+        """
+        move world_obj to another position in the grid, keeping track
+        of the towers that can see it.
+        """
+        old_cells = self.grid.get_cells(world_obj)
+        self.grid.move(world_obj, new_pos)
+        if isinstance(world_obj, Enemy):
+            self.enemy_pool.set_cell(world_obj.index, new_pos)
+            self.enemy_hash.move(world_obj, new_pos)
+            self.update_coverage(world_obj, old_cells,
+                                 self.grid.get_cells(world_obj))
+    
+    def add_tower_coverage(self, tower):
+        """
+        register the cells seen by tower, and the enemies already in
+        them.
+        """
+        tower.covered_cells = tower.get_covered_cells()
+        self.grid.add_coverage(tower, tower.covered_cells)
+        for cell in tower.covered_cells:
+            enemies = [world_obj for world_obj in self.grid.grid.get(cell, ())
+                       if isinstance(world_obj, Enemy) and
+                       world_obj not in tower.enemies_in_range]
+            # in the order of their slots, to get the same order in
+            # every run:
+            enemies.sort(key=attrgetter('index'))
+            for enemy in enemies:
+                tower.enemies_in_range[enemy] = self.sight_order.next()
+    
+    def update_coverage(self, enemy, old_cells, new_cells):
+        """
+        the enemy left old_cells and is now in new_cells, update the
+        enemies in range of the towers that see them.
+        """
+        old_towers = self.grid.get_towers_covering(old_cells)
+        new_towers = self.grid.get_towers_covering(new_cells)
+        for tower in old_towers - new_towers:
+            del tower.enemies_in_range[enemy]
+        for tower in new_towers - old_towers:
+            tower.enemies_in_range[enemy] = self.sight_order.next()
+    
     def update(self, dt):
-        for tower in self.towers:
-            tower.update()
+        """
+        advance the world one tick. no object is added or removed
+        until the end of the tick, when the recorded commands are
+        applied.
+        """
+        self.forget_left_objects()
+        with self.commands:
+            if self.simulates_motion:
+                for enemy in self.enemy_pool.advance(dt):
+                    enemy.reach_next_cell()
+            
+            if self.batch_targeting:
+                self.targets = find_targets(self.towers, self.enemy_pool,
+                                            self.flow_field)
+            with self.event_buffer:
+                for tower in self.towers:
+                    tower.update()
+                    if self.simulates_motion:
+                        tower.turn(dt)
+            self.targets = None
+            
+            self.hit_shots(self.clock.time + dt)
+            self.commands.add(self.apply_damage)
+    
+    def forget_left_objects(self):
+        """
+        break the references between the objects that left the world
+        and their listeners and sprites, so they are freed without
+        waiting for the garbage collector.
+        """
+        left_objects = self.left_objects
+        self.left_objects = []
+        for world_obj in left_objects:
+            world_obj.clear_listeners()
+            world_obj.sprite = None
+            if self.recycles_enemies and isinstance(world_obj, Enemy):
+                self.enemy_recycler.put(world_obj)
+    
+    def hurt(self, enemy, damage):
+        """
+        hurt the enemy. during an update, the damage is added up in the
+        enemy pool, and taken from the lives of all the enemies at once
+        at the end.
+        """
+        if self.commands.is_active:
+            self.enemy_pool.add_damage(enemy.index, damage)
+        else:
+            enemy.get_hurt(damage)
+    
+    def hit_shots(self, time):
+        """
+        the shots that get to their target by time hurt it, if it is
+        still in the world (the shots forget the enemies that leave),
+        or all the enemies around if the shots splash.
+        """
+        for enemy, damage, splash_radius, end in self.shots.hit(time):
+            if splash_radius:
+                for near_enemy in self.enemy_hash.get_in_radius(
+                        end, splash_radius):
+                    self.hurt(near_enemy, damage)
+            elif enemy is not None:
+                self.hurt(enemy, damage)
+    
+    def apply_damage(self):
+        """
+        take the damage added up in the update from the lives of the
+        enemies
+        """
+        for enemy, damage in self.enemy_pool.apply_damage():
+            enemy.notify('get_hurt', damage)
+            if enemy.lives <= 0:
+                enemy.enemy_die()
     
     def activate_tower(self, tower):
         self.deactivate_tower()
@@ -191,27 +755,26 @@ class World(Notifier):
         if self.active_tower is not None:
             self.active_tower.deactivate()
     
-    def calculate_paths(self):
+    def calculate_paths(self, changed_cells=None):
         """
         calculate the paths to the HG (for the enemies)
-        """
-        self.paths = {}
         
+        changed_cells: the cells that became solid or free since the
+        last calculation. if given, only the affected part of the
+        paths is repaired, instead of calculating them again.
+        """
         target = self.hq.grid_pos
-        solid_cells = self.grid.get_solid_cells()
-        q = [target]
-        while len(q):
-            cell = q.pop(0)
-            if cell in solid_cells:
-                continue
-            for dire in Grid.possible_dirs:
-                new_cell = (cell[0] - dire[0], cell[1] - dire[1])
-                if not ((0 <= new_cell[0] < self.grid.size[0]) and 
-                        (0 <= new_cell[1] < self.grid.size[1])):
-                    continue
-                if new_cell not in self.paths:
-                    self.paths[new_cell] = dire
-                    q.append(new_cell)
+        if changed_cells is None or self.flow_field.target != target:
+            self.flow_field.calculate(target)
+        else:
+            self.flow_field.repair(changed_cells)
+    
+    def get_paths(self):
+        """
+        grid cell -> direction to move, for the enemies
+        """
+        return self.flow_field.paths
+    paths = property(get_paths)
 
 
 class WorldObject(Notifier):
@@ -220,6 +783,7 @@ class WorldObject(Notifier):
     
     it notifies changes so the GUI can be updated.
     """
+    __slots__ = ('world', 'grid_pos', 'event_buffer', 'sprite')
     
     # the object's width and height measured in grid cells
     size = (1, 1)
@@ -232,12 +796,28 @@ class WorldObject(Notifier):
         
         # the position of the object's top left corner in the grid
         self.grid_pos = None
+        
+        self.event_buffer = None
+        
+        # the GUI representation, if any:
+        self.sprite = None
+    
+    def get_position(self):
+        """
+        the position of the object's center, measured in grid cells.
+        
+        the GUI provides a smooth one, while the object moves.
+        """
+        return (self.grid_pos[0] + self.size[0] / 2.0,
+                self.grid_pos[1] + self.size[1] / 2.0)
     
     def enter_world(self, world):
         self.world = world
+        self.event_buffer = world.event_buffer
 
     @notify
     def leave_world(self):
+        self.world.left_objects.append(self)
         self.world = None
 
 
@@ -257,6 +837,13 @@ class Tower(WorldObject):
     # how fast goes the shot in grid cells per second
     shot_speed = 8
     
+    # the lives that a shot takes from the enemy it hits
+    shot_damage = 1
+    
+    # the radius around the end of a shot where the enemies get hurt,
+    # or 0 to hurt only the target
+    splash_radius = 0
+    
     # the radius where the tower can see enemies
     sight_radius = 3
     
@@ -266,49 +853,145 @@ class Tower(WorldObject):
     # how much is gained if this tower is removed from the wold
     resources_to_remove = -30
     
+    # which enemy at sight to shoot, one of targeting_policies
+    targeting = 'first'
+    
+    # how fast does the tower turn, in degrees per second (the GUI
+    # turns it in 0.08 seconds)
+    rotation_speed = 2250
+    
     def __init__(self):
         super(Tower, self).__init__()
         
         # the desired angle to shoot
         self.target_angle = 0
+
+        # the enemy to shoot, found in each update:
+        self.target_enemy = None
+
+        # the angle the tower points to, when the world simulates the
+        # motion:
+        self.rotation = 0
+        
+        # when was the last shot, in the world's clock:
+        self.last_shot = None
         
-        self.last_shot = time.time()
+        # the cells near enough to be seen, and the enemies in them
+        # (enemy -> order in which it got in range), kept by the world:
+        self.covered_cells = []
+        self.enemies_in_range = {}
     
     def calc_sight(self, enemy):
-        # provided by the GUI
-        return 0
+        """
+        return if the enemy is at sight, its distance (in grid cells)
+        and the angle to aim at it, in degrees.
+        """
+        tower_x, tower_y = self.get_position()
+        enemy_x, enemy_y = enemy.get_position()
+        dx = enemy_x - tower_x
+        dy = enemy_y - tower_y
+        
+        distance = math.sqrt(dx**2 + dy**2)
+        angle = math.degrees(math.atan2(dx, dy))
+        
+        return distance < self.sight_radius, distance, angle
+    
+    def get_covered_cells(self):
+        """
+        the cells inside the grid where an enemy can be seen.
+        
+        an enemy is drawn up to one cell away from its grid position
+        while it moves, so the radius has one cell of margin.
+        """
+        center_x = self.grid_pos[0] + self.size[0] / 2.0
+        center_y = self.grid_pos[1] + self.size[1] / 2.0
+        radius = self.sight_radius + 1
+        grid_size = self.world.grid.size
+        
+        cells = []
+        for x in range(max(int(center_x - radius), 0),
+                       min(int(center_x + radius) + 1, grid_size[0])):
+            for y in range(max(int(center_y - radius), 0),
+                           min(int(center_y + radius) + 1, grid_size[1])):
+                dx = x + 0.5 - center_x
+                dy = y + 0.5 - center_y
+                if dx * dx + dy * dy <= radius * radius:
+                    cells.append((x, y))
+        return cells
     
     def get_enemies_at_sight(self):
         enemies_at_sight = []
-        for enemy in self.world.enemies:
+        for enemy in self.enemies_in_range:
             at_sight, distance, angle = self.calc_sight(enemy)
             if at_sight:
                 enemies_at_sight.append((enemy, distance, angle))
         return enemies_at_sight
     
-    def is_shooting_time(self):
-        return time.time() - self.last_shot > self.shoot_reload
+    def get_target_key(self, enemy):
+        """
+        how good is the enemy as a target, the lower the better,
+        following the tower's targeting policy.
+        """
+        policy = targeting_policies[self.targeting]
+        return policy(self, enemy)
     
-    @notify
-    def shoot(self):
-        # TODO: only to test!
-        self.target_enemy.get_hurt(1)
+    def choose_target(self, enemies_at_sight):
+        """
+        return the (enemy, distance, angle) to shoot.
+        """
+        def target_key(enemy_at_sight):
+            return self.get_target_key(enemy_at_sight[0])
+        return min(enemies_at_sight, key=target_key)
+    
+    def find_target(self):
+        """
+        return the (enemy, distance, angle) to shoot, or None if there
+        isn't any enemy at sight.
+        """
+        if self.world.targets is not None:
+            # the enemies are removed at the end of the update, so all
+            # the targets are still in the world:
+            return self.world.targets.get(self)
         
-        self.last_shot = time.time()
+        enemies_at_sight = self.get_enemies_at_sight()
+        if len(enemies_at_sight) > 0:
+            return self.choose_target(enemies_at_sight)
+        return None
+    
+    def enter_world(self, world):
+        super(Tower, self).enter_world(world)
+        # the tower starts reloading:
+        self.last_shot = world.clock.time
+    
+    def is_shooting_time(self):
+        return self.world.clock.time - self.last_shot > self.shoot_reload
     
     @notify
+    def shoot(self):
+        """
+        fire a shot to the target enemy, that hurts it when it gets
+        there.
+        """
+        now = self.world.clock.time
+        self.world.shots.add(self.get_position(), self.target_angle,
+                             self.target_distance, self.shot_speed,
+                             self.target_enemy, self.shot_damage, now,
+                             self.splash_radius)
+        self.last_shot = now
+    
+    @notify_changes('target_angle', 'is_shooting')
     def update(self):
         """
-        called in each iteration of the world
+        called in each iteration of the world, the GUI gets notified
+        only when the target angle or the shooting change.
         """
         is_shooting = False
-        enemies_at_sight = self.get_enemies_at_sight()
-        if len(enemies_at_sight) > 0:
-            enemy, distance, angle = enemies_at_sight[0]
+        self.target_enemy = None
+        target = self.find_target()
+        if target is not None:
+            enemy, distance, angle = target
             self.target_distance = distance
             self.target_angle = angle
-            
-            # TODO: only to test!
             self.target_enemy = enemy
             
             if angle_difference(self.target_angle, self.angle) < 10:
@@ -319,9 +1002,29 @@ class Tower(WorldObject):
         if self.is_shooting and self.is_shooting_time():
             self.shoot()
     
+    def turn(self, dt):
+        """
+        turn the tower dt seconds towards the target angle, the
+        shortest way.
+        """
+        difference = self.get_turn_difference()
+        max_turn = self.rotation_speed * dt
+        if abs(difference) <= max_turn:
+            self.rotation = self.target_angle
+        elif difference > 0:
+            self.rotation += max_turn
+        else:
+            self.rotation -= max_turn
+    
+    def get_turn_difference(self):
+        """
+        the degrees to turn to point to the target angle, the shortest
+        way (negative to turn left).
+        """
+        return (self.target_angle - self.rotation + 180) % 360 - 180
+    
     def get_angle(self):
-        # provided by the GUI
-        return 0
+        return self.rotation
     angle = property(get_angle)
     
     @notify
@@ -338,7 +1041,15 @@ class Tower(WorldObject):
 class Enemy(WorldObject):
     """
     an enemy that tries to reach the hq before the towers kill him.
+    
+    while it is in a world, its lives and the way done to the next
+    cell are kept in the world's enemy pool, and the enemy is only a
+    handle to its slot there.
     """
+    # the subclasses should also have __slots__, to keep the enemies
+    # small:
+    __slots__ = ('pool', 'index', 'direction', 'next_direction',
+                 'own_lives', 'own_move_progress')
     
     # how many lives this enemy has when born
     initial_lives = 3
@@ -354,19 +1065,83 @@ class Enemy(WorldObject):
     
     def __init__(self):
         super(Enemy, self).__init__()
+        self.reset()
+    
+    def reset(self):
+        """
+        set the state of a new enemy, to reuse this one after it left
+        the world and its listeners were forgotten.
+        """
+        self.grid_pos = None
+        
+        # the enemy pool and the slot in it, while in a world:
+        self.pool = None
+        self.index = None
         
         self.lives = self.initial_lives
         
         # directions to move:
         self.direction = self.initial_direction
         self.next_direction = None
+        
+        # the part of the way to the next cell already done, when the
+        # world simulates the motion:
+        self.move_progress = 0.0
+    
+    def get_lives(self):
+        if self.index is None:
+            return self.own_lives
+        return self.pool.lives[self.index]
+    
+    def set_lives(self, lives):
+        if self.index is None:
+            self.own_lives = lives
+        else:
+            self.pool.lives[self.index] = lives
+    lives = property(get_lives, set_lives)
+    
+    def get_move_progress(self):
+        if self.index is None:
+            return self.own_move_progress
+        return self.pool.progress[self.index]
+    
+    def set_move_progress(self, move_progress):
+        if self.index is None:
+            self.own_move_progress = move_progress
+        else:
+            self.pool.progress[self.index] = move_progress
+    move_progress = property(get_move_progress, set_move_progress)
+    
+    def set_next_direction(self, direction):
+        self.next_direction = direction
+        if self.index is not None:
+            self.pool.set_direction(self.index, direction)
+    
+    def get_position(self):
+        # the way done to the next cell:
+        x, y = super(Enemy, self).get_position()
+        if self.next_direction is not None:
+            x += self.next_direction[0] * self.move_progress
+            y += self.next_direction[1] * self.move_progress
+        return x, y
+    
+    def reach_next_cell(self):
+        """
+        change of cell for each whole cell of the way done, when the
+        world simulates the motion (it adds the way done by all the
+        enemies at once).
+        """
+        while self.move_progress >= 1 and self.next_direction is not None:
+            self.move_progress -= 1
+            self.move(self.next_direction)
     
     @notify
     def start_move(self):
         """
         called recursively until the directions are traversed
         """
-        self.next_direction = self.world.paths[self.grid_pos]
+        self.set_next_direction(
+            self.world.flow_field.get_direction(self.grid_pos))
     
     def move(self, direction):
         """
@@ -376,17 +1151,19 @@ class Enemy(WorldObject):
         
         new_pos = (self.grid_pos[0] + direction[0],
                    self.grid_pos[1] + direction[1])
-        self.world.grid.move(self, new_pos)
+        self.world.move(self, new_pos)
         
         if self.grid_pos == self.world.hq.grid_pos:
-            self.enemy_success()
+            # it doesn't move anymore, until it is removed:
+            self.set_next_direction(None)
+            self.world.commands.add(self.enemy_success)
         else:
             self.start_move()
     
     @notify
     def get_hurt(self, damage):
         self.lives -= damage
-        if self.lives == 0:
+        if self.lives <= 0:
             self.enemy_die()
     
     @notify
@@ -402,6 +1179,40 @@ class Enemy(WorldObject):
         self.world.remove(self)
 
 
+def first_at_sight(tower, enemy):
+    """
+    the enemies that got in range of the tower before the others go
+    first
+    """
+    return tower.enemies_in_range[enemy]
+
+
+def closest_to_hq(tower, enemy):
+    """
+    the enemies with shorter paths to the hq go first
+    """
+    steps = tower.world.flow_field.get_distance(enemy.grid_pos)
+    if steps is None:
+        steps = float('inf')
+    return steps, first_at_sight(tower, enemy)
+
+
+def strongest(tower, enemy):
+    """
+    the enemies with more lives go first
+    """
+    return -enemy.lives, first_at_sight(tower, enemy)
+
+
+# targeting policy name -> function that gives the key to sort the
+# enemies at sight of a tower:
+targeting_policies = {
+    'first': first_at_sight,
+    'closest to hq': closest_to_hq,
+    'strongest': strongest,
+}
+
+
 class Hq(WorldObject):
     """
     the place to defend with towers
@@ -449,6 +1260,26 @@ class ResourceManager(Notifier):
 # solid world classes:
 solid_classes = [Tower, Rock]
 
+# world object class -> True if it is solid:
+_solid_per_class = {}
+
+def is_solid_object(world_obj):
+    """
+    True if world_obj is an instance of any of the solid classes.
+    
+    the answer is cached per class, so the isinstance checks are done
+    only once.
+    """
+    world_obj_class = world_obj.__class__
+    is_solid = _solid_per_class.get(world_obj_class)
+    if is_solid is None:
+        is_solid = False
+        for solid_class in solid_classes:
+            if issubclass(world_obj_class, solid_class):
+                is_solid = True
+        _solid_per_class[world_obj_class] = is_solid
+    return is_solid
+
 
 class Level(Notifier):
     """
@@ -458,7 +1289,7 @@ class Level(Notifier):
     for example, when the user adds a tower, the level reduces the
     resources, creates the tower object, and adds it to the world.
     """
-    def __init__(self, level_data, previous_resources=None):
+    def __init__(self, level_data, previous_resources=None, seed=None):
         """
         
         level_data: the data necessary to start the level
@@ -466,6 +1297,9 @@ class Level(Notifier):
         previous_resources: the resources left in the previous level,
         if any.
         
+        seed: to get the same random choices each time the level is
+        played.
+        
         """
         super(Level, self).__init__()
 
@@ -475,9 +1309,31 @@ class Level(Notifier):
         if previous_resources is not None:
             initial_resources += previous_resources
         
-        self.world = World(grid_size=settings.GRID_SIZE)
+        grid_class = grid_backends[settings.GRID_BACKEND]
+        flow_field_class = flow_field_backends[settings.FLOW_FIELD_BACKEND]
+        self.world = World(grid_size=settings.GRID_SIZE,
+                           grid_class=grid_class,
+                           flow_field_class=flow_field_class)
+        self.world.batch_targeting = settings.BATCH_TARGETING
+        # with or without GUI, the world moves the enemies and turns the
+        # towers with its clock, so pausing it or changing its speed
+        # applies to them:
+        self.world.simulates_motion = True
+        self.world.recycles_enemies = True
+        self.clock = self.world.clock
         self.resources = ResourceManager(initial_resources)
         self.level_data = level_data
+        self.random = random.Random(seed)
+        
+        self.is_spawning = False
+        self.time_to_spawn = settings.SPAWN_SECS
+        
+        # None until the level is done, then True if the user won:
+        self.user_success = None
+        
+        # enemies that reached the hq, and killed by the towers:
+        self.enemies_passed = 0
+        self.enemies_killed = 0
     
     def start(self):
         """
@@ -509,19 +1365,25 @@ class Level(Notifier):
         for enemy_class, number in level_data['enemies'].items():
             self.enemies_to_spawn.append((enemy_class, number))
         self.enemies_to_spawn.reverse()
+        self.is_spawning = len(self.enemies_to_spawn) > 0
         
         self.world.calculate_paths()
     
     def add_world_object(self, world_object_class, grid_pos,
                          *args, **kwargs):
         """
-        create a world object and add it to the world
+        create a world object and add it to the world, the enemies
+        are reused from the ones that left it.
         """
-        world_obj = world_object_class()
+        if issubclass(world_object_class, Enemy):
+            world_obj = self.world.enemy_recycler.get(world_object_class)
+        else:
+            world_obj = world_object_class()
         world_obj.add_listener(self)
         self.world.add(world_obj, grid_pos)
         if isinstance(world_obj, Enemy):
             world_obj.start_move()
+        return world_obj
     
     def spawn_enemy(self, dt):
         enemy_class, num = self.enemies_to_spawn[0]
@@ -533,12 +1395,46 @@ class Level(Notifier):
         else:
             self.enemies_to_spawn[0] = enemy_class, num
         
-        pos = (random.randint(0, settings.GRID_SIZE[0]-1), 0)
-        self.add_world_object(enemy_class, pos)
+        pos = (self.random.randint(0, settings.GRID_SIZE[0]-1), 0)
+        self.world.commands.add(self.add_world_object, enemy_class, pos)
     
     @notify
     def stop_spawning(self):
-        pass
+        self.is_spawning = False
+    
+    def update(self, dt):
+        """
+        advance the level after dt real seconds, running the steps
+        that the clock says, at its speed.
+        """
+        for i in range(self.clock.advance(dt)):
+            if self.user_success is not None:
+                break
+            self.step()
+    
+    def step(self):
+        """
+        advance the level one step of the clock: spawn the enemies on
+        time and update the world.
+        """
+        step = self.clock.step
+        if self.is_spawning:
+            self.time_to_spawn -= step
+            while self.is_spawning and self.time_to_spawn <= 0:
+                self.spawn_enemy(settings.SPAWN_SECS)
+                self.time_to_spawn += settings.SPAWN_SECS
+        
+        self.world.update(step)
+        self.clock.tick()
+    
+    def run(self):
+        """
+        run the level as fast as possible until it is done, returns
+        True if the user won.
+        """
+        while self.user_success is None:
+            self.step()
+        return self.user_success
 
     def _check_no_more_enemies(self):
         if len(self.enemies_to_spawn) == 0 and \
@@ -546,15 +1442,18 @@ class Level(Notifier):
             self.done(user_success=True)
     
     def on_enemy_success(self, enemy):
+        self.enemies_passed += 1
         self.world.hq.loose_energy(10)
         if self.world.hq.energy < 0:
             self.done(user_success=False)
-        self._check_no_more_enemies()
+        else:
+            self._check_no_more_enemies()
     
     def on_enemy_die(self, enemy):
         """
         a tower kills an enemy
         """
+        self.enemies_killed += 1
         self.resources.operate('kill enemy')
         self._check_no_more_enemies()
     
@@ -565,22 +1464,24 @@ class Level(Notifier):
         assert issubclass(tower_class, Tower)
         
         self.resources.operate('add tower')
-        self.add_world_object(tower_class, grid_pos)
+        tower = self.add_world_object(tower_class, grid_pos)
         
-        self.world.calculate_paths()
+        changed_cells = self.world.grid.get_cells(tower)
+        self.world.calculate_paths(changed_cells)
     
     def remove_tower(self, tower):
         """
         the user removes a tower from the world
         """
         self.resources.operate('remove tower')
+        changed_cells = self.world.grid.get_cells(tower)
         self.world.remove(tower)
         
-        self.world.calculate_paths()
+        self.world.calculate_paths(changed_cells)
     
     @notify
     def done(self, user_success):
-        pass
+        self.user_success = user_success
     
 
 def test():
@@ -642,6 +1543,38 @@ def test():
     >>> print resource_manager.resources
     10
     
+    >>> enemy = Enemy()
+    >>> world.add(enemy, (9, 6))
+    >>> print tower.enemies_in_range.keys() == [enemy]
+    True
+    
+    >>> world.move(enemy, (10, 6))
+    >>> print len(tower.enemies_in_range)
+    0
+    
+    a level runs without GUI, the world moves the enemies and turns
+    the towers with its clock:
+    
+    >>> level_data = {'enemies': {Enemy: 5},
+    ...               'initial towers': {Tower: [(10, 2)]},
+    ...               'initial resources': 100}
+    >>> level = Level(level_data, seed=1)
+    >>> level.start()
+    >>> level.clock.set_speed(16)
+    >>> while level.user_success is None:
+    ...     level.update(1.0 / settings.FPS)
+    
+    running it as fast as possible gives the same result:
+    
+    >>> fast_level = Level(level_data, seed=1)
+    >>> fast_level.start()
+    >>> print fast_level.run() == level.user_success
+    True
+    >>> print fast_level.world.hq.energy == level.world.hq.energy
+    True
+    >>> print fast_level.clock.time == level.clock.time
+    True
+    
     """
     
     import doctest
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+from optparse import OptionParser
+
 import pyglet.resource
 from cocos.director import director
 from cocos.scenes import FadeTransition
@@ -42,6 +44,15 @@ class LevelSelector(object):
 
 
 def main():
+    parser = OptionParser()
+    parser.add_option('--trace', metavar='FILE',
+                      help='record a chrome trace of the game in FILE')
+    options, args = parser.parse_args()
+    
+    if options.trace is not None:
+        from tracing import tracer
+        tracer.start(options.trace)
+    
     pyglet.resource.path.append("images")
     pyglet.resource.reindex()
     
@@ -51,7 +62,11 @@ def main():
     settings.WINDOW_SIZE = director.get_window_size()
 
     level_sel = LevelSelector(levels_data)
-    level_sel.next()
+    try:
+        level_sel.next()
+    finally:
+        if options.trace is not None:
+            tracer.stop()
 
 
 if __name__ == '__main__':
@@ -1,3 +1,8 @@
+import functools
+import types
+import weakref
+from collections import OrderedDict
+
 
 class Notifier(object):
     """
@@ -39,33 +44,307 @@ class Notifier(object):
     >>> tower.reset()
     little tower resetted
     
+    >>> print tower.move.__name__
+    move
+
+    a weak listener listens while something else keeps it alive:
+
+    >>> weak_sprite = TowerSprite()
+    >>> tower.remove_listener(tower_sprite)
+    >>> tower.add_listener(weak_sprite, weak=True)
+    >>> tower.reset()
+    little tower resetted
+    >>> del weak_sprite
+    >>> tower.reset()
+    >>> print len(tower.listeners)
+    0
+
+    a handler can also be set on a listener, before adding it:
+
+    >>> other_sprite = TowerSprite()
+    >>> def on_reset(tower):
+    ...     print '%s resetted, seen by other sprite' % tower.name
+    >>> other_sprite.on_reset = on_reset
+    >>> tower.add_listener(other_sprite)
+    >>> tower.reset()
+    little tower resetted, seen by other sprite
+    >>> tower.remove_listener(other_sprite)
+
+    removing a listener that isn't listening fails:
+
+    >>> tower.remove_listener('not listening')
+    Traceback (most recent call last):
+    ...
+    KeyError: 'not listening'
+
     """
+    # the subclasses without __slots__ get a __dict__ as always, the
+    # ones with many instances can avoid it:
+    __slots__ = ('listeners', 'dispatch', 'notified_states')
+    
+    # the buffer where the notify_changes events are queued, if any:
+    event_buffer = None
+    
     def __init__(self):
         self.listeners = set()
+        
+        # event name -> handlers of the listeners, bound to them:
+        self.dispatch = {}
+        
+        # event name -> state notified the last time, for the events
+        # notified only when the state changes:
+        self.notified_states = {}
     
-    def add_listener(self, listener):
+    def add_listener(self, listener, weak=False):
+        """
+        weak: if True, the notifier keeps only a weak reference to the
+        listener, that stops listening when nothing else refers to it.
+        """
+        if weak:
+            listener = weakref.ref(listener)
         self.listeners.add(listener)
+        self.dispatch.clear()
+        # the new listener needs to know the current state:
+        self.notified_states.clear()
     
     def remove_listener(self, listener):
+        """
+        stop notifying the listener, raises KeyError if it isn't
+        listening.
+        """
+        if listener not in self.listeners:
+            # a weak reference compares equal to the listener's:
+            try:
+                listener = weakref.ref(listener)
+            except TypeError:
+                # it can't be weakly referenced, so it isn't listening:
+                raise KeyError(listener)
         self.listeners.remove(listener)
+        self.dispatch.clear()
+    
+    def clear_listeners(self):
+        """
+        forget all the listeners
+        """
+        self.listeners.clear()
+        self.dispatch.clear()
+        self.notified_states.clear()
     
     def notify(self, event_name, *args, **kwargs):
-        for listener in self.listeners:
-            callback = getattr(listener, 'on_' + event_name, None)
-            if callback is not None:
-                callback(self, *args, **kwargs)
+        try:
+            handlers = self.dispatch[event_name]
+        except KeyError:
+            handlers = self.dispatch[event_name] = \
+                self.bind_handlers(event_name)
+        for handler in handlers:
+            handler(self, *args, **kwargs)
+    
+    def bind_handlers(self, event_name):
+        """
+        return the handlers of the event of each listener, bound to
+        the listener.
+        """
+        handlers = []
+        for listener in list(self.listeners):
+            if isinstance(listener, weakref.ref):
+                listener_ref = listener
+                listener = listener_ref()
+                if listener is None:
+                    self.listeners.discard(listener_ref)
+                    continue
+            else:
+                listener_ref = None
+            listener_class = listener.__class__
+            key = (listener_class, event_name)
+            if 'on_' + event_name in getattr(listener, '__dict__', ()):
+                # set on the listener itself, not cached per class:
+                handler = _get_listener_handler('on_' + event_name)
+            else:
+                try:
+                    handler = _handlers[key]
+                except KeyError:
+                    handler = _handlers[key] = \
+                        _find_handler(listener_class, event_name)
+            if handler is None:
+                continue
+            if listener_ref is None:
+                handlers.append(handler.__get__(listener, listener_class))
+            else:
+                handlers.append(_bind_weak(handler, listener_ref))
+        return handlers
+    
+    def notify_if_changed(self, event_name, attributes, args, kwargs):
+        """
+        notify the event only if the attributes changed since the last
+        time it was notified.
+        """
+        state = tuple(getattr(self, name) for name in attributes)
+        if self.notified_states.get(event_name, _NOTHING) != state:
+            self.notified_states[event_name] = state
+            self.notify(event_name, *args, **kwargs)
+
+
+class EventBuffer(object):
+    """
+    while active (in a with statement), collects the events of the
+    notify_changes methods, to notify them when it ends. the events
+    of the same notifier are notified only once, with the arguments
+    of the last call.
+    
+    >>> class Tower(Notifier):
+    ...    angle = 0
+    ...
+    ...    @notify_changes('angle')
+    ...    def update(self, angle):
+    ...        self.angle = angle
+    
+    >>> class TowerSprite(object):
+    ...    def on_update(self, tower, angle):
+    ...        print 'rotate to', angle
+    
+    >>> tower = Tower()
+    >>> tower.add_listener(TowerSprite())
+    >>> tower.event_buffer = EventBuffer()
+    >>> with tower.event_buffer:
+    ...     tower.update(10)
+    ...     tower.update(20)
+    rotate to 20
+    
+    the state didn't change, so it isn't notified:
+    
+    >>> with tower.event_buffer:
+    ...     tower.update(20)
+    """
+    def __init__(self):
+        self.is_active = False
+        
+        # (notifier, event name) -> (attributes, args, kwargs):
+        self.pending = OrderedDict()
+    
+    def __enter__(self):
+        self.is_active = True
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.is_active = False
+        self.flush()
+    
+    def add(self, notifier, event_name, attributes, args, kwargs):
+        self.pending[(notifier, event_name)] = (attributes, args, kwargs)
+    
+    def flush(self):
+        """
+        notify the pending events
+        """
+        # cleared in place, a new ordered dict each tick would be
+        # garbage with cycles for the collector:
+        pending = self.pending.items()
+        self.pending.clear()
+        for (notifier, event_name), (attributes, args, kwargs) in pending:
+            notifier.notify_if_changed(event_name, attributes, args, kwargs)
+
+
+# a state that is never notified:
+_NOTHING = object()
+
+
+# (listener class, event name) -> the function that handles the
+# event, or None if the class doesn't handle it:
+_handlers = {}
+
+
+def _find_handler(listener_class, event_name):
+    """
+    look for the method that handles the event in the listener class
+    """
+    handler_name = 'on_' + event_name
+    handler = getattr(listener_class, handler_name, None)
+    if handler is None:
+        return None
+    if isinstance(handler, types.MethodType) and handler.__self__ is None:
+        # a plain method, called with the listener as self:
+        return handler.__func__
+    
+    # anything else is looked up in each listener:
+    return _get_listener_handler(handler_name)
+
+
+def _get_listener_handler(handler_name):
+    """
+    a handler that looks for the method in the listener each time
+    """
+    def handler_of_listener(listener, *args, **kwargs):
+        return getattr(listener, handler_name)(*args, **kwargs)
+    return handler_of_listener
+
+
+def _bind_weak(handler, listener_ref):
+    """
+    bind the handler to a weakly referenced listener, without keeping
+    it alive. once the listener is gone, the notifier forgets it.
+    """
+    def weak_handler(notifier, *args, **kwargs):
+        listener = listener_ref()
+        if listener is None:
+            notifier.listeners.discard(listener_ref)
+            notifier.dispatch.clear()
+        else:
+            return handler(listener, notifier, *args, **kwargs)
+    return weak_handler
+
+
+def clear_handlers():
+    """
+    forget the handlers found, needed only if the listener classes
+    change their on_ methods while running. the notifiers forget
+    theirs when a listener is added or removed, so an on_ method set
+    on a listener itself is found if it is set before the listener is
+    added.
+    """
+    _handlers.clear()
 
 
 def notify(func):
     """
     decorator to notify methods
     """
+    event_name = func.__name__
+    
+    @functools.wraps(func)
     def inner(notifier, *args, **kwargs):
-        func(notifier, *args, **kwargs)
-        notifier.notify(func.__name__, *args, **kwargs)
+        result = func(notifier, *args, **kwargs)
+        if notifier.listeners:
+            notifier.notify(event_name, *args, **kwargs)
+        return result
     return inner
 
 
+def notify_changes(*attributes):
+    """
+    decorator to notify methods that are called again and again, like
+    the updates of each frame. the listeners are notified only when
+    the given attributes of the notifier change, and only once per
+    tick if the notifier has an active event buffer.
+    """
+    def decorator(func):
+        event_name = func.__name__
+        
+        @functools.wraps(func)
+        def inner(notifier, *args, **kwargs):
+            result = func(notifier, *args, **kwargs)
+            if notifier.listeners:
+                event_buffer = notifier.event_buffer
+                if event_buffer is not None and event_buffer.is_active:
+                    event_buffer.add(notifier, event_name, attributes,
+                                     args, kwargs)
+                else:
+                    notifier.notify_if_changed(event_name, attributes,
+                                               args, kwargs)
+            return result
+        return inner
+    return decorator
+
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
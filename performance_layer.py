@@ -0,0 +1,102 @@
+from collections import deque
+
+import pyglet
+from pyglet.gl import *
+
+from cocos.layer import Layer
+
+from profiling import profiler
+
+
+class PerformanceLayer(Layer):
+    """
+    the times and counts of the last frames and ticks, over the world.
+
+    it is hidden until toggled, and the profiler measures the ticks
+    only while it is shown. the text is a single multiline label in a
+    batch of its own, updated a few times per second.
+    """
+    # seconds between the updates of the text:
+    update_secs = 0.5
+
+    text_color = (255, 255, 0, 255)
+
+    def __init__(self, world_layer):
+        super(PerformanceLayer, self).__init__()
+        self.world_layer = world_layer
+
+        # the text goes in the top left corner of the world:
+        top = world_layer.split_rect.height - 10
+        self.batch = pyglet.graphics.Batch()
+        self.label = pyglet.text.Label('', font_size=10,
+                                       color=self.text_color,
+                                       x=10, y=top, width=400,
+                                       multiline=True, anchor_y='top',
+                                       batch=self.batch)
+
+        # seconds of the last frames:
+        self.frame_times = deque(maxlen=60)
+
+        self.visible = False
+
+    def toggle(self):
+        if self.visible:
+            self.hide()
+        else:
+            self.show()
+
+    def show(self):
+        self.visible = True
+        self.frame_times.clear()
+        profiler.reset()
+        profiler.enable()
+        self.schedule(self.count_frame)
+        self.schedule_interval(self.update_text, self.update_secs)
+
+    def hide(self):
+        self.visible = False
+        profiler.disable()
+        self.unschedule(self.count_frame)
+        self.unschedule(self.update_text)
+
+    def on_exit(self):
+        super(PerformanceLayer, self).on_exit()
+        if self.visible:
+            self.hide()
+
+    def count_frame(self, dt):
+        self.frame_times.append(dt)
+
+    def update_text(self, dt):
+        if self.frame_times:
+            frame_secs = sum(self.frame_times) / len(self.frame_times)
+        else:
+            frame_secs = 0
+        tick = profiler.get_stats('World.update')
+        notifications = profiler.get_stats('notifications')
+        paths = profiler.get_stats('World.calculate_paths')
+
+        world_layer = self.world_layer
+        shot_sprites = world_layer.shot_sprites
+        shots = (len(shot_sprites.shots_layer.get_children()) -
+                 len(shot_sprites.free))
+
+        lines = [
+            'frame: %.1f msec (%.0f fps)' % (
+                frame_secs * 1e3, 1 / frame_secs if frame_secs else 0),
+            'tick: %.2f msec p50, %.2f msec p95' % (
+                tick['p50'] or 0, tick['p95'] or 0),
+            'notifications: %d per tick p50, %d p95' % (
+                notifications['p50'] or 0, notifications['p95'] or 0),
+            'paths: %.2f msec max' % (paths['max'] or 0),
+            'sprites: %d towers, %d enemies, %d shots' % (
+                len(world_layer.towers_layer.get_children()),
+                len(world_layer.enemies_layer.get_children()), shots),
+        ]
+        self.label.text = '\n'.join(lines)
+
+    def draw(self):
+        glPushMatrix()
+        self.transform()
+        self.batch.draw()
+        glPopMatrix()
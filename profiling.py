@@ -0,0 +1,314 @@
+"""
+
+measure where the time of each tick goes
+
+"""
+
+import functools
+import math
+from collections import deque
+from timeit import default_timer
+
+from notifier import Notifier
+from logic import Grid, World, Tower
+
+
+class Histogram(object):
+    """
+    the values of the last ticks, to get their percentiles.
+
+    >>> histogram = Histogram(size=100)
+    >>> for value in range(1, 201):
+    ...     histogram.add(value)
+    >>> print histogram.get_percentile(50), histogram.get_percentile(99)
+    150 199
+    """
+    def __init__(self, size):
+        self.values = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value):
+        self.values.append(value)
+
+    def get_percentile(self, percent, sorted_values=None):
+        """
+        the lowest value that is not lower than percent % of the
+        values (or None if there aren't values yet)
+        """
+        if sorted_values is None:
+            sorted_values = sorted(self.values)
+        if not sorted_values:
+            return None
+        rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+        return sorted_values[max(rank, 1) - 1]
+
+    def get_summary(self):
+        """
+        the p50, p95, p99 and max of the values
+        """
+        sorted_values = sorted(self.values)
+        summary = {}
+        for percent in (50, 95, 99):
+            summary['p%d' % percent] = self.get_percentile(percent,
+                                                           sorted_values)
+        summary['max'] = sorted_values[-1] if sorted_values else None
+        return summary
+
+
+# (class, method name) -> (original method, [(method hooks, hook kind,
+# name of the measure) of the hooks enabled on it, the innermost
+# first]):
+_wrapped_methods = {}
+
+
+def _wrap_method(owner, method_name):
+    """
+    set the method of the class to its original, wrapped by each hook
+    enabled on it in order
+    """
+    key = (owner, method_name)
+    original, layers = _wrapped_methods[key]
+    method = original
+    for hooks, kind, name in layers:
+        method = getattr(hooks, 'wrap_' + kind)(method, name)
+    setattr(owner, method_name, method)
+    if not layers:
+        del _wrapped_methods[key]
+
+
+class MethodHooks(object):
+    """
+    wraps methods of some classes while it is enabled, and restores
+    them when it is disabled, so it costs nothing when disabled.
+
+    each hook has a kind, and the subclasses wrap the methods of each
+    kind with their wrap_<kind> method. the hooks of different objects
+    on the same method are stacked, so they can be enabled and
+    disabled in any order.
+
+    >>> class Game(object):
+    ...     def update(self):
+    ...         pass
+    >>> class Counter(MethodHooks):
+    ...     calls = 0
+    ...     def wrap_count(self, func, name):
+    ...         def counted(*args):
+    ...             self.calls += 1
+    ...             return func(*args)
+    ...         return counted
+    >>> original = Game.__dict__['update']
+    >>> first, second = Counter(), Counter()
+    >>> for hooks in (first, second):
+    ...     hooks.add_hook(Game, 'update', 'count', 'updates')
+    ...     hooks.enable()
+    >>> first.disable()
+    >>> Game().update()
+    >>> print first.calls, second.calls
+    0 1
+    >>> second.disable()
+    >>> print Game.__dict__['update'] is original
+    True
+    """
+    def __init__(self):
+        self.is_enabled = False
+
+        # (class, method name, hook kind, name of the measure):
+        self.hooks = []
+
+    def add_hook(self, owner, method_name, kind, name):
+        self.hooks.append((owner, method_name, kind, name))
+
+    def enable(self):
+        if self.is_enabled:
+            return
+        self.is_enabled = True
+        for owner, method_name, kind, name in self.hooks:
+            key = (owner, method_name)
+            if key not in _wrapped_methods:
+                _wrapped_methods[key] = (owner.__dict__[method_name], [])
+            _wrapped_methods[key][1].append((self, kind, name))
+            _wrap_method(owner, method_name)
+
+    def disable(self):
+        if not self.is_enabled:
+            return
+        self.is_enabled = False
+        for owner, method_name, kind, name in reversed(self.hooks):
+            layers = _wrapped_methods[(owner, method_name)][1]
+            layers.remove((self, kind, name))
+            _wrap_method(owner, method_name)
+
+
+class Profiler(MethodHooks):
+    """
+    the time spent in some methods and the count of some events in each
+    tick, kept as histograms of the last ticks.
+
+    the methods are wrapped only while the profiler is enabled.
+
+    >>> class Game(object):
+    ...     def update(self):
+    ...         self.shoot()
+    ...         self.shoot()
+    ...     def shoot(self):
+    ...         pass
+    >>> profiler = Profiler(window=10)
+    >>> profiler.add_tick_method(Game, 'update', 'Game.update')
+    >>> profiler.add_counted_method(Game, 'shoot', 'shots')
+    >>> profiler.add_gauge('players', lambda game: 1)
+    >>> game = Game()
+    >>> game.update()
+    >>> profiler.enable()
+    >>> for i in range(3):
+    ...     game.update()
+    >>> profiler.disable()
+    >>> game.update()
+    >>> print profiler.ticks, sorted(profiler.get_stats('shots').items())
+    3 [('max', 2), ('p50', 2), ('p95', 2), ('p99', 2)]
+    >>> print profiler.get_stats('Game.update')['p50'] >= 0
+    True
+    >>> print profiler.get_stats('players')['max']
+    1
+    """
+    def __init__(self, window=300):
+        """
+        window: the number of ticks kept in the histograms
+        """
+        super(Profiler, self).__init__()
+        self.window = window
+        self.ticks = 0
+
+        # name -> function(object that ticks) that gives its value at
+        # the end of each tick:
+        self.gauges = {}
+
+        # name -> seconds or count in the current tick:
+        self.timers = {}
+        self.counters = {}
+
+        # name -> histogram of the values per tick, the times in msec:
+        self.histograms = {}
+
+    def add_timed_method(self, owner, method_name, name):
+        """
+        measure the time spent in a method of the class owner
+        """
+        self.add_hook(owner, method_name, 'time', name)
+
+    def add_counted_method(self, owner, method_name, name):
+        """
+        count the calls to a method of the class owner
+        """
+        self.add_hook(owner, method_name, 'count', name)
+
+    def add_tick_method(self, owner, method_name, name):
+        """
+        measure the time of the method that runs each tick, the tick
+        ends when it returns
+        """
+        self.add_hook(owner, method_name, 'tick', name)
+
+    def add_gauge(self, name, get_value):
+        self.gauges[name] = get_value
+
+    def disable(self):
+        super(Profiler, self).disable()
+        self.timers.clear()
+        self.counters.clear()
+
+    def reset(self):
+        """
+        forget the measures of the past ticks
+        """
+        self.ticks = 0
+        self.histograms.clear()
+        self.timers.clear()
+        self.counters.clear()
+
+    def wrap_time(self, func, name):
+        timers = self.timers
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timers[name] = timers.get(name, 0.0) + \
+                    default_timer() - start
+        return timed
+
+    def wrap_count(self, func, name):
+        counters = self.counters
+
+        @functools.wraps(func)
+        def counted(*args, **kwargs):
+            counters[name] = counters.get(name, 0) + 1
+            return func(*args, **kwargs)
+        return counted
+
+    def wrap_tick(self, func, name):
+        timed = self.wrap_time(func, name)
+
+        @functools.wraps(func)
+        def tick(ticking, *args, **kwargs):
+            try:
+                return timed(ticking, *args, **kwargs)
+            finally:
+                self.end_tick(ticking)
+        return tick
+
+    def end_tick(self, ticking):
+        """
+        add the measures of the tick to the histograms
+        """
+        self.ticks += 1
+        for name, get_value in self.gauges.iteritems():
+            self.get_histogram(name).add(get_value(ticking))
+        for name, secs in self.timers.iteritems():
+            self.get_histogram(name).add(secs * 1e3)
+        for name, count in self.counters.iteritems():
+            self.get_histogram(name).add(count)
+
+        # the measures not taken in this tick count as 0:
+        for owner, method_name, kind, name in self.hooks:
+            if name not in self.timers and name not in self.counters:
+                self.get_histogram(name).add(0)
+        self.timers.clear()
+        self.counters.clear()
+
+    def get_histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.window)
+        return histogram
+
+    def get_stats(self, name=None):
+        """
+        the p50, p95, p99 and max per tick of a measure (in msec for
+        the times), or a dict of name -> stats of all the measures.
+        """
+        if name is not None:
+            return self.get_histogram(name).get_summary()
+        return dict((name, histogram.get_summary())
+                    for name, histogram in self.histograms.iteritems())
+
+
+# the profiler of the game logic, enable it to start measuring:
+profiler = Profiler()
+profiler.add_tick_method(World, 'update', 'World.update')
+profiler.add_timed_method(Tower, 'update', 'Tower.update')
+profiler.add_timed_method(World, 'calculate_paths', 'World.calculate_paths')
+profiler.add_timed_method(Grid, 'move', 'Grid.move')
+profiler.add_timed_method(Notifier, 'notify', 'Notifier.notify')
+profiler.add_counted_method(Tower, 'shoot', 'shots fired')
+profiler.add_counted_method(Notifier, 'notify', 'notifications')
+profiler.add_counted_method(World, 'calculate_paths', 'path recomputes')
+profiler.add_gauge('enemies alive', lambda world: len(world.enemies))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -7,6 +7,21 @@ SPAWN_SECS = 1
 WINDOW_SIZE = None
 GRID_SIZE = (16, 16)
 
+# how the grid stores its cells, 'dict' or 'array':
+GRID_BACKEND = 'dict'
+
+# how the enemy paths are stored, 'dict' or 'array' (for very large
+# grids, faster with numpy installed):
+FLOW_FIELD_BACKEND = 'dict'
+
+# find the targets of all the towers in one pass (faster with numpy
+# installed), instead of each tower on its own:
+BATCH_TARGETING = False
+
+# draw the towers, enemies and shots of the world from a batch per
+# layer, instead of one draw call per sprite:
+BATCHED_SPRITES = False
+
 # height of the info area:
 INFO_HEIGHT = 90
 
@@ -0,0 +1,196 @@
+"""
+
+the shots flying in a world, kept in parallel arrays
+
+"""
+
+import heapq
+import math
+from array import array
+
+
+class ShotPool(object):
+    """
+    the shots fired by the towers that didn't reach their target yet.
+
+    a shot flies straight, at the speed of its tower, to where its
+    target was when it was fired, and hurts the target when it gets
+    there (or the enemies around, if it has a splash radius). the
+    target is hurt wherever it moved meanwhile, a shot never misses,
+    as when the towers hurt their targets at once.
+
+    the start, velocity and times of the shots are kept in arrays
+    indexed by the shot's slot, and the hit times also in a heap, so
+    the next shots that arrive are found without going through the
+    others.
+
+    the slots of the shots that arrived are reused, the lowest first.
+
+    >>> pool = ShotPool()
+    >>> enemy = 'enemy'
+    >>> pool.add((0.0, 0.0), 0, 2.0, 8, enemy, 1, time=10.0)
+    0
+    >>> print pool.get_position(0, 10.125)
+    (0.0, 1.0)
+    >>> print pool.get_next_hit_time()
+    10.25
+    >>> print pool.hit(10.2) == []
+    True
+    >>> print pool.hit(10.25) == [(enemy, 1, 0.0, (0.0, 2.0))], len(pool)
+    True 0
+
+    the shots of a target that is gone still fly, but hit no target:
+
+    >>> pool.add((0.0, 0.0), 0, 2.0, 8, enemy, 1, time=10.0)
+    0
+    >>> pool.forget_target(enemy)
+    >>> print pool.hit(10.25) == [(None, 1, 0.0, (0.0, 2.0))]
+    True
+    """
+    def __init__(self, capacity=64):
+        # slot -> target of the shot, None for the free slots:
+        self.targets = []
+        
+        # target -> slots of the shots flying to it:
+        self.slots_per_target = {}
+
+        # (hit time, slot) of the flying shots, and of some that
+        # arrived, ignored because their slot is free or has a shot
+        # with another hit time:
+        self.hit_times = []
+
+        # the slots after the last used one are never free, only the
+        # slots before it are used in the operations of the pool:
+        self.free = []
+        self.size = 0
+        self.capacity = 0
+
+        self.start_x = array('d')
+        self.start_y = array('d')
+        self.velocity_x = array('d')
+        self.velocity_y = array('d')
+        self.start_time = array('d')
+        self.hit_time = array('d')
+        self.damage = array('i')
+        self.splash_radius = array('d')
+        # 1 if the shot is flying:
+        self.flying = bytearray()
+
+        self.grow(capacity)
+
+    def __len__(self):
+        return self.size - len(self.free)
+
+    def grow(self, capacity):
+        """
+        make room for capacity shots
+        """
+        extra = capacity - self.capacity
+        self.targets.extend([None] * extra)
+        for values in (self.start_x, self.start_y, self.velocity_x,
+                       self.velocity_y, self.start_time, self.hit_time,
+                       self.splash_radius):
+            values.extend(array('d', [0.0]) * extra)
+        self.damage.extend(array('i', [0]) * extra)
+        self.flying.extend(bytearray(extra))
+        self.capacity = capacity
+
+    def add(self, start, angle, distance, speed, target, damage, time,
+            splash_radius=0.0):
+        """
+        fire a shot from start (in grid cells) to the target, at
+        distance in the direction of angle (in degrees), that flies
+        at speed grid cells per second.
+        
+        if splash_radius isn't 0, the shot hurts all the enemies in
+        that radius when it gets to its end.
+
+        returns the slot of the shot.
+        """
+        if self.free:
+            index = heapq.heappop(self.free)
+        else:
+            if self.size == self.capacity:
+                self.grow(self.capacity * 2)
+            index = self.size
+            self.size += 1
+
+        ang_radians = math.radians(angle)
+        self.targets[index] = target
+        slots = self.slots_per_target.get(target)
+        if slots is None:
+            slots = self.slots_per_target[target] = []
+        slots.append(index)
+        self.start_x[index], self.start_y[index] = start
+        self.velocity_x[index] = speed * math.sin(ang_radians)
+        self.velocity_y[index] = speed * math.cos(ang_radians)
+        self.start_time[index] = time
+        hit_time = self.hit_time[index] = time + float(distance) / speed
+        heapq.heappush(self.hit_times, (hit_time, index))
+        self.damage[index] = damage
+        self.splash_radius[index] = splash_radius
+        self.flying[index] = 1
+        return index
+
+    def forget_target(self, target):
+        """
+        the target is gone, its shots hit None
+        """
+        for index in self.slots_per_target.pop(target, ()):
+            self.targets[index] = None
+    
+    def get_position(self, index, time):
+        """
+        where the shot is at time, in grid cells
+        """
+        flight_time = time - self.start_time[index]
+        return (self.start_x[index] + self.velocity_x[index] * flight_time,
+                self.start_y[index] + self.velocity_y[index] * flight_time)
+
+    def get_next_hit_time(self):
+        """
+        when the next shot gets to its target, or None if there aren't
+        shots flying.
+        """
+        hit_times = self.hit_times
+        while hit_times:
+            hit_time, index = hit_times[0]
+            if self.flying[index] and self.hit_time[index] == hit_time:
+                return hit_time
+            heapq.heappop(hit_times)
+        return None
+
+    def hit(self, time):
+        """
+        free the shots that got to their target by time, returns the
+        (target, damage, splash radius, end position) of each one.
+        """
+        hit_times, flying = self.hit_times, self.flying
+        arrived = []
+        while hit_times and hit_times[0][0] <= time:
+            hit_time, index = heapq.heappop(hit_times)
+            if flying[index] and self.hit_time[index] == hit_time:
+                flying[index] = 0
+                arrived.append(index)
+        # in the order of the slots, whatever their hit times:
+        arrived.sort()
+
+        hits = []
+        for index in arrived:
+            target = self.targets[index]
+            if target is not None:
+                slots = self.slots_per_target[target]
+                slots.remove(index)
+                if not slots:
+                    del self.slots_per_target[target]
+            end = self.get_position(index, self.hit_time[index])
+            hits.append((target, self.damage[index],
+                         self.splash_radius[index], end))
+            self.targets[index] = None
+            heapq.heappush(self.free, index)
+        return hits
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
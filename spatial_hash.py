@@ -0,0 +1,162 @@
+"""
+
+find the objects near a point of the world
+
+"""
+
+import math
+
+from utils import OrderedSet
+
+
+class SpatialHash(object):
+    """
+    the objects of a world, in buckets of bucket_size x bucket_size
+    grid cells, to find the ones near a point without looking at all
+    of them.
+
+    an object is kept in the bucket of its grid position, so it only
+    changes of bucket when it changes of cell. the queries use the
+    objects' get_position, that can be up to margin cells away from
+    the grid position (an enemy moving to its next cell), and the
+    buckets around the asked area are looked too.
+
+    >>> class Enemy(object):
+    ...     def __init__(self, position):
+    ...         self.position = position
+    ...     def get_position(self):
+    ...         return self.position
+    >>> spatial_hash = SpatialHash()
+    >>> near, far = Enemy((2.5, 2.5)), Enemy((9.5, 2.5))
+    >>> spatial_hash.add(near, (2, 2))
+    >>> spatial_hash.add(far, (9, 2))
+    >>> print spatial_hash.get_in_radius((3, 3), 2) == [near]
+    True
+    >>> print spatial_hash.get_in_rect((0, 0), (10, 3)) == [near, far]
+    True
+    >>> far.position = (3.5, 3.5)
+    >>> spatial_hash.move(far, (3, 3))
+    >>> print spatial_hash.get_nearest((4, 4), 1) == [far]
+    True
+    """
+    def __init__(self, bucket_size=4, margin=1):
+        self.bucket_size = bucket_size
+        self.margin = margin
+
+        # bucket -> objects in it, the emptied buckets are kept to be
+        # reused:
+        self.buckets = {}
+
+        # object -> its bucket:
+        self.bucket_per_object = {}
+
+    def __len__(self):
+        return len(self.bucket_per_object)
+
+    def get_bucket(self, grid_pos):
+        return (int(grid_pos[0]) // self.bucket_size,
+                int(grid_pos[1]) // self.bucket_size)
+
+    def add(self, obj, grid_pos):
+        bucket = self.get_bucket(grid_pos)
+        self.bucket_per_object[obj] = bucket
+        objects = self.buckets.get(bucket)
+        if objects is None:
+            objects = self.buckets[bucket] = OrderedSet()
+        objects.add(obj)
+
+    def remove(self, obj):
+        bucket = self.bucket_per_object.pop(obj)
+        self.buckets[bucket].remove(obj)
+
+    def move(self, obj, grid_pos):
+        if self.get_bucket(grid_pos) != self.bucket_per_object[obj]:
+            self.remove(obj)
+            self.add(obj, grid_pos)
+
+    def get_candidates(self, corner, opposite_corner):
+        """
+        the objects of the buckets that can have objects positioned
+        in the rectangle between the corners
+        """
+        margin = self.margin
+        first_x, first_y = self.get_bucket((corner[0] - margin - 1,
+                                            corner[1] - margin - 1))
+        last_x, last_y = self.get_bucket((opposite_corner[0] + margin,
+                                          opposite_corner[1] + margin))
+        buckets = self.buckets
+        candidates = []
+        for bucket_x in xrange(first_x, last_x + 1):
+            for bucket_y in xrange(first_y, last_y + 1):
+                objects = buckets.get((bucket_x, bucket_y))
+                if objects is not None:
+                    candidates.extend(objects)
+        return candidates
+
+    def get_in_rect(self, corner, opposite_corner):
+        """
+        the objects positioned in the rectangle between the corners
+        (corner is the one with the lowest coordinates)
+        """
+        in_rect = []
+        for obj in self.get_candidates(corner, opposite_corner):
+            x, y = obj.get_position()
+            if corner[0] <= x <= opposite_corner[0] and \
+                    corner[1] <= y <= opposite_corner[1]:
+                in_rect.append(obj)
+        return in_rect
+
+    def get_in_radius(self, center, radius):
+        """
+        the objects positioned less than radius away from center
+        """
+        center_x, center_y = center
+        candidates = self.get_candidates((center_x - radius,
+                                          center_y - radius),
+                                         (center_x + radius,
+                                          center_y + radius))
+        in_radius = []
+        for obj in candidates:
+            x, y = obj.get_position()
+            dx = x - center_x
+            dy = y - center_y
+            if dx * dx + dy * dy < radius * radius:
+                in_radius.append(obj)
+        return in_radius
+
+    def get_nearest(self, center, number):
+        """
+        the number objects nearest to center, the nearest first
+        """
+        if not self.bucket_per_object:
+            return []
+
+        # the farthest that an object can be, from the used buckets:
+        size, margin = self.bucket_size, self.margin
+        columns = [bucket[0] for bucket in self.buckets]
+        rows = [bucket[1] for bucket in self.buckets]
+        min_x = min(columns) * size - margin
+        max_x = (max(columns) + 1) * size + margin
+        min_y = min(rows) * size - margin
+        max_y = (max(rows) + 1) * size + margin
+        max_radius = math.hypot(
+            max(abs(center[0] - min_x), abs(center[0] - max_x)),
+            max(abs(center[1] - min_y), abs(center[1] - max_y)))
+
+        radius = self.bucket_size
+        while True:
+            near = self.get_in_radius(center, radius)
+            if len(near) >= number or radius > max_radius:
+                break
+            radius *= 2
+
+        def distance(obj):
+            x, y = obj.get_position()
+            return (x - center[0]) ** 2 + (y - center[1]) ** 2
+        near.sort(key=distance)
+        return near[:number]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -2,7 +2,7 @@ import math
 
 from cocos.cocosnode import CocosNode
 from cocos.sprite import Sprite
-from cocos.actions import MoveBy, RotateBy, RotateTo, CallFunc, \
+from cocos.actions import MoveBy, RotateBy, CallFunc, \
     FadeOut, ScaleTo, ScaleBy, FadeTo, Delay
 
 from cocos.text import Label
@@ -15,26 +15,6 @@ from settings import GRID_CELL
 from veronica_logic import *
 
 
-def sight_function(tower, enemy):
-    dx = enemy.sprite.position[0] - tower.sprite.position[0]
-    dy = enemy.sprite.position[1] - tower.sprite.position[1]
-    
-    distance = math.sqrt(dx**2 + dy**2)
-    ang_radians = math.atan2(dx, dy)
-    angle = math.degrees(ang_radians)
-    
-    sight_px = tower.sight_radius * GRID_CELL
-    
-    return distance < sight_px, distance, angle
-
-Tower.calc_sight = sight_function
-
-def get_angle(tower):
-    return tower.sprite.head.rotation
-Tower.get_angle = get_angle
-Tower.angle = property(get_angle)
-
-
 class WorldSprite(CocosNode):
     """
     the representation of a world object, is a composition of coco's
@@ -43,15 +23,18 @@ class WorldSprite(CocosNode):
     name = 'no image'
     world_object_class = WorldObject
     
+    # the image file, named after the sprite if None:
+    image = None
+    
     def __init__(self, world_object):
         super(WorldSprite, self).__init__()
         assert(world_object.__class__ == self.world_object_class)
         
         # links between logic and representation:
-        world_object.add_listener(self)
+        world_object.add_listener(self, weak=True)
         
-        # needed to get data from the world representation, position
-        # in pixels, actual rotation of the sprite, etc.
+        # the world layer shows each frame where the world moved the
+        # object, and finds its sprite here:
         world_object.sprite = self
         
         self.setup(world_object)
@@ -60,7 +43,7 @@ class WorldSprite(CocosNode):
         """
         do the sprite composition and place it in the grid
         """
-        filename = self.name.replace(' ', '_') + '.png'
+        filename = self.image or self.name.replace(' ', '_') + '.png'
         try:
             self.sprite = Sprite(filename)
             self.sprite.scale = 0.5 # sprites at double scale
@@ -68,7 +51,12 @@ class WorldSprite(CocosNode):
         except ResourceNotFoundException:
             pass
         
-        # place the sprite in the location given by the grid.
+        self.place(world_obj)
+    
+    def place(self, world_obj):
+        """
+        place the sprite in the location given by the grid
+        """
         x, y = world_obj.grid_pos
         width, height = world_obj.size
         self.position = ((x + width / 2.0) * GRID_CELL,
@@ -83,11 +71,44 @@ class WorldSprite(CocosNode):
 
 
 class EnemySprite(WorldSprite):
-    def __init__(self, enemy):
+    """
+    when the enemy leaves the world, the sprite is put in the recycler
+    once its last animation is done, to be reset for another enemy of
+    the same class.
+    """
+    def __init__(self, enemy, recycler, life_bars):
+        self.life_bars = life_bars
         super(EnemySprite, self).__init__(enemy)
         
-        self.move_vel = 1.0 / enemy.speed
+        self.recycler = recycler
+        self.rotate_vel = 0.5 / enemy.speed
+    
+    def reset(self, enemy, recycler, life_bars):
+        """
+        represent another enemy, reusing the sprite composition
+        """
+        enemy.add_listener(self, weak=True)
+        enemy.sprite = self
+        
+        self.recycler = recycler
         self.rotate_vel = 0.5 / enemy.speed
+        
+        # undo the last animation:
+        self.stop()
+        self.body.stop()
+        self.rotation = 0
+        self.scale = 1
+        self.body.rotation = 0
+        self.body.opacity = 255
+        self.body.color = (255, 255, 255)
+        
+        self.lifebar.reset(enemy)
+        self.add(self.lifebar)
+        self.place(enemy)
+    
+    def recycle(self):
+        self.remove_me()
+        self.recycler.put(self)
     
     def setup(self, enemy):
         """
@@ -103,7 +124,7 @@ class EnemySprite(WorldSprite):
         self.add(self.body, z=20)
         
         # add lifebar:
-        self.lifebar = LifeBarSprite(enemy)
+        self.lifebar = LifeBarSprite(enemy, self.life_bars)
         self.add(self.lifebar)
     
     def get_rotation_angle(self, direction, new_direction):
@@ -128,19 +149,30 @@ class EnemySprite(WorldSprite):
     
     def on_start_move(self, enemy):
         """
-        do a smooth move of the enemy and update the enemy when done
+        turn the body of the enemy to its next cell. the world moves
+        the enemy with its clock, and the world layer shows it there.
         """
-        move_px = (enemy.next_direction[0] * GRID_CELL,
-                   enemy.next_direction[1] * GRID_CELL)
+        if enemy.next_direction is None:
+            return
+        
+        # the actions go faster when the game is fast forwarded:
+        speed = enemy.world.clock.speed
         
         # rotate if needed
         angle = self.get_rotation_angle(enemy.direction,
                                         enemy.next_direction)
         if angle != 0:
-            self.body.do(RotateBy(angle, self.rotate_vel))
-        
-        self.do(MoveBy(move_px, self.move_vel) +
-                CallFunc(enemy.move, enemy.next_direction))
+            self.body.do(RotateBy(angle, self.rotate_vel / speed))
+    
+    def follow(self, enemy):
+        """
+        show the enemy where the world has it
+        """
+        x, y = enemy.get_position()
+        position = (x * GRID_CELL, y * GRID_CELL)
+        if position != self.position:
+            self.position = position
+            self.lifebar.invalidate()
     
     def on_get_hurt(self, enemy, damage):
         self.body.color = (255, 100, 100)
@@ -154,14 +186,14 @@ class EnemySprite(WorldSprite):
         self.stop()
         self.remove(self.lifebar)
         
-        self.do(RotateBy(360, 0.5) * 3 + CallFunc(self.remove_me))
+        self.do(RotateBy(360, 0.5) * 3 + CallFunc(self.recycle))
         self.body.do(FadeTo(20, 1.5))
     
     def on_enemy_success(self, enemy):
         self.stop()
         self.remove(self.lifebar)
         
-        self.do(ScaleTo(0.01, 1.5) + CallFunc(self.remove_me))
+        self.do(ScaleTo(0.01, 1.5) + CallFunc(self.recycle))
         self.body.do(FadeTo(20, 1.5))
 
 
@@ -170,13 +202,40 @@ class RockSprite(WorldSprite):
     world_object_class = Rock
 
 
+class ShotSprites(object):
+    """
+    the shot sprites of a layer. the sprites of the shots that got to
+    their target are hidden and reused for the next shots, instead of
+    making a new sprite for each shot.
+    """
+    def __init__(self, shots_layer):
+        self.shots_layer = shots_layer
+        self.free = []
+    
+    def get(self):
+        if self.free:
+            shot_sprite = self.free.pop()
+            shot_sprite.visible = True
+        else:
+            shot_sprite = Sprite('shot.png')
+            shot_sprite.scale = 0.5
+            self.shots_layer.add(shot_sprite, z=30)
+        return shot_sprite
+    
+    def put(self, shot_sprite):
+        shot_sprite.visible = False
+        self.free.append(shot_sprite)
+
+
 class TowerSprite(WorldSprite):
     
-    def __init__(self, tower, shots_layer):
+    # the image file of the head, named after the sprite if None:
+    head_image = None
+    
+    def __init__(self, tower, shot_sprites):
         super(TowerSprite, self).__init__(tower)
 
-        self.shots_layer = shots_layer
-        self.shot_speed_px = tower.shot_speed * GRID_CELL
+        self.shot_sprites = shot_sprites
     
     def setup(self, tower):
         """
@@ -185,7 +244,8 @@ class TowerSprite(WorldSprite):
         super(TowerSprite, self).setup(tower)
         
         # add head sprite:
-        head_filename = self.name.replace(' ', '_') + '_head.png'
+        head_filename = self.head_image or \
+            self.name.replace(' ', '_') + '_head.png'
         self.head = Sprite(head_filename)
         self.head.scale = 0.42
         self.head.position = self.head_position
@@ -202,13 +262,19 @@ class TowerSprite(WorldSprite):
     
     def on_update(self, tower):
         """
-        called each frame
+        called when the tower starts or stops shooting, or aims
+        somewhere else
         """
         if tower.is_shooting:
             self.sight.opacity = 90
         else:
             self.sight.opacity = 30
-        self.head.do(RotateTo(tower.target_angle, 0.08))
+    
+    def follow(self, tower):
+        """
+        show the head where the world turned it
+        """
+        self.head.rotation = tower.rotation
     
     def on_activate(self, tower):
         self.sight.visible = True
@@ -218,11 +284,10 @@ class TowerSprite(WorldSprite):
     
     def on_shoot(self, tower):
         """
-        when the tower shoots, add a shot sprite
+        when the tower shoots, show a shot that gets to the target when
+        the logic's shot does
         """
-        shot_sprite = Sprite('shot.png')
-        shot_sprite.scale = 0.5
-        self.shots_layer.add(shot_sprite, z=30)
+        shot_sprite = self.shot_sprites.get()
         
         ang_radians = math.radians(tower.angle)
         x = math.sin(ang_radians)
@@ -230,16 +295,14 @@ class TowerSprite(WorldSprite):
         shot_sprite.position = (self.x + self.shot_position * x,
                                  self.y + self.shot_position * y)
         
-        shot_distance = tower.target_distance - self.shot_position
+        shot_distance = tower.target_distance * GRID_CELL - self.shot_position
         dx = (shot_distance) * x
         dy = (shot_distance) * y
         
-        def remove_shot(shot):
-            self.shots_layer.remove(shot)
-        
-        t = shot_distance / self.shot_speed_px
+        t = (float(tower.target_distance) / tower.shot_speed /
+             tower.world.clock.speed)
         shot_sprite.do(MoveBy((dx, dy), t) +
-                        CallFunc(remove_shot, shot_sprite))
+                        CallFunc(self.shot_sprites.put, shot_sprite))
     
     def on_leave_world(self, tower):
         self.remove(self.sight)
@@ -269,6 +332,20 @@ class HardTowerSprite(TowerSprite):
     shot_position = 50
 
 
+class SplashTowerSprite(TowerSprite):
+    name = 'splash tower'
+    world_object_class = SplashTower
+    # the base of the hard tower, and the head shown in the hud:
+    image = 'hard_tower.png'
+    head_image = 'impact.png'
+    # the round head turns around its center:
+    head_position = (0, 0)
+    head_anchor = (0, 0)
+    
+    # distance to the border of the head
+    shot_position = 10
+
+
 class CommonEnemySprite(EnemySprite):
     name = 'common enemy'
     world_object_class = CommonEnemy
@@ -283,7 +360,7 @@ class HqSprite(WorldSprite):
     name = 'hq'
     world_object_class = Hq
 
-all_sprites = [CommonTowerSprite, HardTowerSprite, 
+all_sprites = [CommonTowerSprite, HardTowerSprite, SplashTowerSprite,
                CommonEnemySprite, FastEnemySprite, 
                HqSprite, WorldSprite, RockSprite]
 
@@ -0,0 +1,144 @@
+import pyglet
+from pyglet.gl import *
+from pyglet.gl import gl_info
+
+from cocos.director import director
+from cocos.framegrabber import FBOGrabber
+from cocos.layer import Layer
+
+
+class CoverageGroup(pyglet.graphics.Group):
+    """
+    the state to draw the children into the texture. the sprites set
+    their own blend function, that blends their colors over the
+    transparent texture already premultiplied by their alpha, but
+    would multiply the alpha by itself too: the alpha takes the
+    maximum of the children's instead, the coverage of the pixel when
+    there aren't two translucent children over it.
+    """
+    def set_state(self):
+        glPushAttrib(GL_COLOR_BUFFER_BIT)
+        glEnable(GL_BLEND)
+        glBlendEquationSeparate(GL_FUNC_ADD, GL_MAX)
+
+    def unset_state(self):
+        glPopAttrib()
+
+
+class PremultipliedGroup(pyglet.graphics.Group):
+    """
+    the state to blit a texture whose colors are premultiplied by its
+    alpha
+    """
+    def set_state(self):
+        glPushAttrib(GL_COLOR_BUFFER_BIT | GL_CURRENT_BIT)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+        glColor4ub(255, 255, 255, 255)
+
+    def unset_state(self):
+        glPopAttrib()
+
+
+class StaticLayer(Layer):
+    """
+    a layer whose children don't change by themselves (the background,
+    the rocks, the hq), drawn once into a texture with a framebuffer
+    object, and then blitted in one quad each frame.
+
+    the texture is drawn again only when a child is added or removed,
+    when the window is resized, or when invalidate is called. without
+    framebuffer objects, the children are drawn each frame as usual.
+
+    the colors of the texture are premultiplied by its alpha, so the
+    alpha of the children is applied only once when it is blitted.
+    """
+    is_event_handler = True
+
+    def __init__(self):
+        super(StaticLayer, self).__init__()
+        self.uses_fbo = gl_info.have_extension('GL_EXT_framebuffer_object')
+        self.texture = None
+        self.grabber = None
+        self.coverage_group = CoverageGroup()
+        self.premultiplied_group = PremultipliedGroup()
+        self.is_valid = False
+
+    def invalidate(self):
+        """
+        draw the children again in the next frame
+        """
+        self.is_valid = False
+
+    def add(self, child, *args, **kwargs):
+        super(StaticLayer, self).add(child, *args, **kwargs)
+        self.invalidate()
+
+    def remove(self, child):
+        super(StaticLayer, self).remove(child)
+        self.invalidate()
+
+    def on_resize(self, width, height):
+        self.invalidate()
+
+    def visit(self):
+        if not self.uses_fbo:
+            super(StaticLayer, self).visit()
+            return
+        if not self.visible:
+            return
+        if not self.is_valid:
+            self.render()
+
+        width, height = director.get_window_size()
+        glPushMatrix()
+        self.transform()
+        self.premultiplied_group.set_state()
+        self.texture.blit(0, 0, width=width, height=height)
+        self.premultiplied_group.unset_state()
+        glPopMatrix()
+
+    def render(self):
+        """
+        draw the children into the texture, at the size of the window
+        in pixels and in the coordinates of the layer
+        """
+        pixels_width = director.window.width
+        pixels_height = director.window.height
+        if self.texture is None or \
+                (self.texture.width, self.texture.height) != \
+                (pixels_width, pixels_height):
+            self.texture = pyglet.image.Texture.create(
+                pixels_width, pixels_height, GL_RGBA)
+            # a single framebuffer, the new texture is attached to it:
+            if self.grabber is None:
+                self.grabber = FBOGrabber()
+            self.grabber.grab(self.texture)
+
+        width, height = director.get_window_size()
+        glPushAttrib(GL_VIEWPORT_BIT | GL_COLOR_BUFFER_BIT)
+        glViewport(0, 0, pixels_width, pixels_height)
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        glOrtho(0, width, 0, height, -100, 100)
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+
+        self.grabber.before_render(self.texture)
+        # transparent where there are no children:
+        glClearColor(0, 0, 0, 0)
+        glClear(GL_COLOR_BUFFER_BIT)
+        self.coverage_group.set_state()
+        for z, child in self.children:
+            child.visit()
+        self.coverage_group.unset_state()
+        self.grabber.after_render(self.texture)
+
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopAttrib()
+        self.is_valid = True
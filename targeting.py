@@ -0,0 +1,261 @@
+"""
+
+find the targets of many towers at once
+
+"""
+
+import math
+from itertools import imap
+from operator import attrgetter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# with fewer enemies in the range of the towers, the numpy arrays take
+# longer to build than choosing in python:
+MIN_ARRAY_CANDIDATES = 128
+
+
+def find_targets(towers, enemy_pool, flow_field):
+    """
+    return a dict of tower -> (enemy, distance, angle) with the enemy
+    to shoot for each tower that has enemies at sight.
+
+    the candidates of each tower are the enemies in its range, kept by
+    the world from the cells it covers. with numpy installed, the
+    positions of the enemies are read from the arrays of the enemy
+    pool, the squared distances of all the candidates are compared
+    against the sight radius in one pass, and the targeting policy of
+    each tower is resolved with the keys of all its enemies at sight
+    at once. the square root and the angle are calculated only for the
+    chosen enemies. with few candidates, each tower chooses in python.
+
+    >>> from logic import World, Grid, Tower, Enemy
+    >>> world = World(grid_size=(16, 16))
+    >>> towers = [Tower(), Tower()]
+    >>> towers[1].targeting = 'strongest'
+    >>> world.add(towers[0], (2, 2))
+    >>> world.add(towers[1], (10, 2))
+    >>> enemies = [Enemy(), Enemy(), Enemy()]
+    >>> enemies[1].lives = 5
+    >>> for enemy, pos in zip(enemies, [(3, 4), (10, 4), (12, 4)]):
+    ...     world.add(enemy, pos)
+    >>> targets = find_targets(world.towers, world.enemy_pool,
+    ...                        world.flow_field)
+    >>> print targets[towers[0]][0] is enemies[0]
+    True
+    >>> print targets[towers[1]][0] is enemies[1]
+    True
+    >>> print all(targets[tower] == tower.find_target() for tower in towers)
+    True
+
+    a crowded world chooses with the arrays, like each tower on its
+    own:
+
+    >>> import random
+    >>> from logic import Hq
+    >>> rand = random.Random(0)
+    >>> world = World(grid_size=(32, 32))
+    >>> world.add(Hq(), (16, 30))
+    >>> while len(world.towers) < 40:
+    ...     pos = (rand.randrange(31), rand.randrange(29))
+    ...     if world.grid.can_fit_at(Tower, pos):
+    ...         tower = Tower()
+    ...         tower.targeting = rand.choice(['first', 'closest to hq',
+    ...                                        'strongest'])
+    ...         world.add(tower, pos)
+    >>> world.calculate_paths()
+    >>> while len(world.enemies) < 400:
+    ...     pos = (rand.randrange(32), rand.randrange(29))
+    ...     if world.grid.can_fit_at(Enemy, pos):
+    ...         enemy = Enemy()
+    ...         enemy.lives = rand.randint(1, 5)
+    ...         world.add(enemy, pos)
+    ...         enemy.set_next_direction(rand.choice(Grid.possible_dirs))
+    ...         enemy.move_progress = rand.random()
+    >>> targets = find_targets(world.towers, world.enemy_pool,
+    ...                        world.flow_field)
+    >>> print len(targets) > 30
+    True
+    >>> print all(targets.get(tower) == tower.find_target()
+    ...           for tower in world.towers)
+    True
+    """
+    towers = list(towers)
+    if len(towers) == 0 or len(enemy_pool) == 0:
+        return {}
+
+    candidates = sum(len(tower.enemies_in_range) for tower in towers)
+    if numpy is not None and candidates >= MIN_ARRAY_CANDIDATES:
+        chosen = _choose_targets_numpy(towers, enemy_pool, flow_field)
+    else:
+        chosen = _choose_targets_python(towers)
+
+    targets = {}
+    for tower, enemy, (enemy_x, enemy_y) in chosen:
+        tower_x, tower_y = tower.get_position()
+        dx = enemy_x - tower_x
+        dy = enemy_y - tower_y
+        distance = math.sqrt(dx**2 + dy**2)
+        angle = math.degrees(math.atan2(dx, dy))
+        targets[tower] = (enemy, distance, angle)
+    return targets
+
+
+def _choose_targets_python(towers):
+    """
+    the (tower, enemy, enemy position) of the best enemy at sight of
+    each tower, choosing with the tower's get_target_key
+    """
+    chosen = []
+    for tower in towers:
+        tower_x, tower_y = tower.get_position()
+        squared_radius = tower.sight_radius * tower.sight_radius
+        best = None
+        for enemy in tower.enemies_in_range:
+            enemy_x, enemy_y = enemy.get_position()
+            dx = enemy_x - tower_x
+            dy = enemy_y - tower_y
+            if dx * dx + dy * dy < squared_radius:
+                key = tower.get_target_key(enemy)
+                if best is None or key < best[0]:
+                    best = (key, enemy, (enemy_x, enemy_y))
+        if best is not None:
+            chosen.append((tower,) + best[1:])
+    return chosen
+
+
+def _strongest_keys(enemy_pool, flow_field, slots):
+    lives = numpy.frombuffer(enemy_pool.lives, dtype=numpy.int32)
+    return -lives[slots].astype(float)
+
+
+def _closest_to_hq_keys(enemy_pool, flow_field, slots):
+    # the distance is looked up once for each enemy, not for each
+    # tower that sees it:
+    unique_slots, inverse = numpy.unique(slots, return_inverse=True)
+    cell_x, cell_y = enemy_pool.cell_x, enemy_pool.cell_y
+    steps = []
+    for slot in unique_slots.tolist():
+        distance = flow_field.get_distance((cell_x[slot], cell_y[slot]))
+        steps.append(float('inf') if distance is None else distance)
+    return numpy.array(steps, dtype=float)[inverse]
+
+
+# targeting policy name -> function that gives the first part of the
+# keys of the policy (in logic.targeting_policies) for the enemies in
+# some slots, or None if the sight order is the whole key. the towers
+# with other policies choose with their get_target_key:
+array_policies = {
+    'first': None,
+    'closest to hq': _closest_to_hq_keys,
+    'strongest': _strongest_keys,
+}
+
+
+def _get_enemy_positions(enemy_pool):
+    """
+    the x and y arrays of the positions of the enemies in the pool,
+    indexed by slot, like Enemy.get_position gives them
+    """
+    size = enemy_pool.size
+    moving = numpy.frombuffer(enemy_pool.moving, dtype=numpy.uint8)[:size]
+    progress = numpy.frombuffer(enemy_pool.progress)[:size] * moving
+    class_ids = numpy.frombuffer(enemy_pool.class_ids,
+                                 dtype=numpy.uint16)[:size]
+    half_sizes = numpy.array([(enemy_class.size[0] / 2.0,
+                               enemy_class.size[1] / 2.0)
+                              for enemy_class in enemy_pool.classes])
+    half_sizes = half_sizes[class_ids]
+
+    positions = []
+    for axis, cells, directions in (
+            (0, enemy_pool.cell_x, enemy_pool.direction_x),
+            (1, enemy_pool.cell_y, enemy_pool.direction_y)):
+        cells = numpy.frombuffer(cells, dtype=numpy.int32)[:size]
+        directions = numpy.frombuffer(directions, dtype=numpy.int8)[:size]
+        positions.append(cells + half_sizes[:, axis] +
+                         directions * progress)
+    return positions
+
+
+def _choose_targets_numpy(towers, enemy_pool, flow_field):
+    """
+    the (tower, enemy, enemy position) of the best enemy at sight of
+    each tower
+    """
+    array_towers = []
+    other_towers = []
+    for tower in towers:
+        if tower.targeting in array_policies:
+            array_towers.append(tower)
+        else:
+            other_towers.append(tower)
+    chosen = _choose_targets_python(other_towers)
+
+    # the candidates, one (tower index, enemy slot, sight order) for
+    # each enemy in the range of each tower:
+    slots = []
+    orders = []
+    get_index = attrgetter('index')
+    for tower in array_towers:
+        enemies_in_range = tower.enemies_in_range
+        slots.extend(imap(get_index, enemies_in_range))
+        orders.extend(enemies_in_range.itervalues())
+    if len(slots) == 0:
+        return chosen
+    counts = [len(tower.enemies_in_range) for tower in array_towers]
+    tower_indexes = numpy.repeat(numpy.arange(len(array_towers)), counts)
+    slots = numpy.array(slots, dtype=numpy.intp)
+    orders = numpy.array(orders, dtype=numpy.int64)
+
+    enemy_x, enemy_y = _get_enemy_positions(enemy_pool)
+    tower_positions = numpy.array([tower.get_position()
+                                   for tower in array_towers])
+    radii = numpy.array([tower.sight_radius for tower in array_towers],
+                        dtype=float)
+
+    dx = enemy_x[slots] - tower_positions[tower_indexes, 0]
+    dy = enemy_y[slots] - tower_positions[tower_indexes, 1]
+    at_sight = numpy.flatnonzero(dx * dx + dy * dy <
+                                 (radii * radii)[tower_indexes])
+    if at_sight.size == 0:
+        return chosen
+    tower_indexes = tower_indexes[at_sight]
+    slots = slots[at_sight]
+    orders = orders[at_sight]
+
+    keys = numpy.zeros(len(slots))
+    policies = [tower.targeting for tower in array_towers]
+    for policy in set(policies):
+        policy_keys = array_policies[policy]
+        if policy_keys is None:
+            continue
+        is_policy = numpy.array([tower_policy == policy
+                                 for tower_policy in policies])
+        pairs = numpy.flatnonzero(is_policy[tower_indexes])
+        keys[pairs] = policy_keys(enemy_pool, flow_field, slots[pairs])
+
+    # sorted by tower, then by key and sight order, the best enemy of
+    # each tower is its first one:
+    sorted_pairs = numpy.lexsort((orders, keys, tower_indexes))
+    sorted_towers = tower_indexes[sorted_pairs]
+    is_first = numpy.ones(len(sorted_pairs), dtype=bool)
+    is_first[1:] = sorted_towers[1:] != sorted_towers[:-1]
+    best = sorted_pairs[is_first]
+
+    handles = enemy_pool.handles
+    for tower_index, slot, x, y in zip(tower_indexes[best].tolist(),
+                                       slots[best].tolist(),
+                                       enemy_x[slots[best]].tolist(),
+                                       enemy_y[slots[best]].tolist()):
+        chosen.append((array_towers[tower_index], handles[slot], (x, y)))
+    return chosen
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+record the execution of a level as a chrome trace, to open it in
+chrome://tracing or https://ui.perfetto.dev
+
+the trace has a span for each tick, tower update, path calculation
+and notification, and counters of the enemies and towers in the
+world.
+
+to trace the game, run:  python main.py --trace trace.json
+to trace a level headless, run:  python tracing.py LEVEL -o trace.json
+"""
+
+import functools
+import json
+import os
+import Queue
+import threading
+from optparse import OptionParser
+from timeit import default_timer
+
+from notifier import Notifier
+from logic import World, Tower
+from profiling import MethodHooks
+
+
+class TraceWriter(object):
+    """
+    writes the trace events to a file in the json array format, from
+    a thread of its own. the events are sent to the thread in chunks,
+    so the traced code only appends them to a list.
+    """
+    def __init__(self, filename, chunk_size=2000):
+        self.chunk_size = chunk_size
+        self.events = []
+        self.queue = Queue.Queue()
+
+        self.file = open(filename, 'w')
+        self.file.write('[')
+        self.is_first = True
+
+        self.thread = threading.Thread(target=self.write_chunks)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, event):
+        """
+        add an event, as a (phase, name, category, microseconds,
+        duration in microseconds, args) tuple
+        """
+        self.events.append(event)
+        if len(self.events) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.events:
+            self.queue.put(self.events)
+            self.events = []
+
+    def close(self):
+        """
+        write the pending events and close the file
+        """
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.file.write('\n]\n')
+        self.file.close()
+
+    def write_chunks(self):
+        pid = os.getpid()
+        while True:
+            events = self.queue.get()
+            if events is None:
+                break
+            lines = []
+            for phase, name, category, ts, duration, args in events:
+                event = {'ph': phase, 'name': name, 'cat': category,
+                         'ts': ts, 'pid': pid, 'tid': 1}
+                if duration is not None:
+                    event['dur'] = duration
+                if args is not None:
+                    event['args'] = args
+                lines.append(json.dumps(event))
+            if self.is_first:
+                self.file.write('\n')
+                self.is_first = False
+            else:
+                self.file.write(',\n')
+            self.file.write(',\n'.join(lines))
+
+
+class Tracer(MethodHooks):
+    """
+    while started, adds an event to the trace for each call of some
+    methods.
+
+    >>> import tempfile
+    >>> class Game(object):
+    ...     enemies = [1, 2]
+    ...     def update(self):
+    ...         self.shoot()
+    ...     def shoot(self):
+    ...         pass
+    >>> tracer = Tracer()
+    >>> tracer.add_tick_method(Game, 'update', 'tick')
+    >>> tracer.add_span_method(Game, 'shoot', 'shoot')
+    >>> tracer.add_counter('enemies', lambda game: len(game.enemies))
+    >>> filename = tempfile.mktemp()
+    >>> tracer.start(filename)
+    >>> Game().update()
+    >>> tracer.stop()
+    >>> events = json.load(open(filename))
+    >>> print [(event['ph'], event['name']) for event in events]
+    [(u'X', u'shoot'), (u'X', u'tick'), (u'C', u'world')]
+    >>> print events[2]['args']
+    {u'enemies': 2}
+    >>> os.remove(filename)
+    """
+    def __init__(self):
+        super(Tracer, self).__init__()
+        self.writer = None
+        self.start_time = None
+
+        # name -> function(object that ticks) that gives the value of
+        # the counter at the end of each tick:
+        self.counters = {}
+
+    def add_span_method(self, owner, method_name, name):
+        """
+        add a span for each call to a method of the class owner
+        """
+        self.add_hook(owner, method_name, 'span', name)
+
+    def add_tick_method(self, owner, method_name, name):
+        """
+        add a span for each call to the method that runs each tick,
+        and the counters after it
+        """
+        self.add_hook(owner, method_name, 'tick', name)
+
+    def add_notify_method(self, owner, method_name, name):
+        """
+        add a span for each notification, named after the event
+        """
+        self.add_hook(owner, method_name, 'notify', name)
+
+    def add_counter(self, name, get_value):
+        self.counters[name] = get_value
+
+    def start(self, filename):
+        self.writer = TraceWriter(filename)
+        self.start_time = default_timer()
+        self.enable()
+
+    def stop(self):
+        self.disable()
+        self.writer.close()
+        self.writer = None
+
+    def wrap_span(self, func, name, get_name=None):
+        writer = self.writer
+        start_time = self.start_time
+
+        @functools.wraps(func)
+        def span(*args, **kwargs):
+            start = default_timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = default_timer()
+                span_name = name if get_name is None else get_name(args)
+                writer.add(('X', span_name, 'logic',
+                            (start - start_time) * 1e6,
+                            (end - start) * 1e6, None))
+        return span
+
+    def wrap_tick(self, func, name):
+        span = self.wrap_span(func, name)
+
+        @functools.wraps(func)
+        def tick(ticking, *args, **kwargs):
+            try:
+                return span(ticking, *args, **kwargs)
+            finally:
+                self.add_counters(ticking)
+        return tick
+
+    def wrap_notify(self, func, name):
+        def get_name(args):
+            return '%s %s' % (name, args[1])
+        return self.wrap_span(func, name, get_name)
+
+    def add_counters(self, ticking):
+        if self.counters:
+            values = dict((name, get_value(ticking))
+                          for name, get_value in self.counters.iteritems())
+            self.writer.add(('C', 'world', 'logic',
+                             (default_timer() - self.start_time) * 1e6,
+                             None, values))
+
+
+# the tracer of the game logic:
+tracer = Tracer()
+tracer.add_tick_method(World, 'update', 'tick')
+tracer.add_span_method(Tower, 'update', 'Tower.update')
+tracer.add_span_method(World, 'calculate_paths', 'World.calculate_paths')
+tracer.add_notify_method(Notifier, 'notify', 'notify')
+tracer.add_counter('enemies', lambda world: len(world.enemies))
+tracer.add_counter('towers', lambda world: len(world.towers))
+
+
+def main():
+    from logic import Level
+    from levels_data import levels_data
+
+    parser = OptionParser(usage='%prog LEVEL [options]')
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='seed of the random choices (default 0)')
+    parser.add_option('-o', '--output', default='trace.json',
+                      help='file to write the trace (default trace.json)')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('the level number is needed')
+
+    level_number = int(args[0])
+    if not 0 <= level_number < len(levels_data):
+        parser.error('there are %d levels' % len(levels_data))
+
+    level = Level(levels_data[level_number], seed=options.seed)
+    tracer.start(options.output)
+    try:
+        level.start()
+        level.run()
+    finally:
+        tracer.stop()
+
+
+if __name__ == '__main__':
+    main()
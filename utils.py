@@ -1,4 +1,6 @@
 
+from collections import OrderedDict
+
 from settings import GRID_CELL
 
 
@@ -13,3 +15,88 @@ def get_cell_from_point(x, y):
     this is relative to the WorldLayer
     """
     return int(x / GRID_CELL), int(y / GRID_CELL)
+
+
+class OrderedSet(object):
+    """
+    a set that iterates in insertion order, so the simulation runs
+    the same way each time.
+
+    >>> items = OrderedSet()
+    >>> for item in 'bca':
+    ...     items.add(item)
+    >>> items.remove('c')
+    >>> print list(items), len(items), 'a' in items
+    ['b', 'a'] 2 True
+    """
+    def __init__(self):
+        self.items = OrderedDict()
+
+    def add(self, item):
+        self.items[item] = None
+
+    def remove(self, item):
+        del self.items[item]
+
+    def discard(self, item):
+        self.items.pop(item, None)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class Recycler(object):
+    """
+    free lists of objects of several classes, to reuse them instead of
+    making new ones. the objects are reset with the arguments of their
+    constructor when reused.
+
+    >>> class Shot(object):
+    ...     def __init__(self, speed):
+    ...         self.reset(speed)
+    ...     def reset(self, speed):
+    ...         self.speed = speed
+    >>> recycler = Recycler()
+    >>> shot = recycler.get(Shot, 5)
+    >>> recycler.put(shot)
+    >>> reused = recycler.get(Shot, 8)
+    >>> print reused is shot, reused.speed, len(recycler)
+    True 8 0
+    """
+    def __init__(self):
+        # class -> objects to reuse:
+        self.free = {}
+
+    def __len__(self):
+        return sum(len(objects) for objects in self.free.itervalues())
+
+    def get(self, cls, *args, **kwargs):
+        """
+        an object of the class cls, reused if there is one
+        """
+        objects = self.free.get(cls)
+        if objects:
+            obj = objects.pop()
+            obj.reset(*args, **kwargs)
+            return obj
+        return cls(*args, **kwargs)
+
+    def put(self, obj):
+        """
+        keep obj to reuse it, nothing else should use it meanwhile
+        """
+        objects = self.free.get(obj.__class__)
+        if objects is None:
+            objects = self.free[obj.__class__] = []
+        objects.append(obj)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -16,15 +16,27 @@ class HardTower(Tower):
     resources_to_add = 80
     resources_to_remove = -50
 
+class SplashTower(Tower):
+    size = (2, 2)
+    shoot_reload = 1.6
+    shot_speed = 6
+    sight_radius = 4
+    splash_radius = 1.5
+    resources_to_add = 80
+    resources_to_remove = -50
+
 class CommonEnemy(Enemy):
+    __slots__ = ()
     initial_lives = 4
     speed = 1.2
 
 class FastEnemy(Enemy):
+    __slots__ = ()
     initial_lives = 2
     speed = 1.8
 
 class BossEnemy(Enemy):
+    __slots__ = ()
     initial_lives = 20
     speed = 5.0
 